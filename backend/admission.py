@@ -0,0 +1,190 @@
+"""
+Connection Admission Control and Graceful Drain
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+
+class AdmissionController:
+    """Caps concurrent handshakes and coordinates drain on shutdown"""
+
+    def __init__(self, max_handshakes=64, max_queue=512, queue_timeout=5.0,
+                 retry_after=2.0, sleep=time.sleep, poll_interval=0.05):
+        self.max_handshakes = max_handshakes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._pending_writes = 0
+        self.draining = False
+
+    @classmethod
+    def from_env(cls, sleep=time.sleep):
+        return cls(
+            max_handshakes=int(os.getenv('MAX_CONCURRENT_HANDSHAKES', '64')),
+            max_queue=int(os.getenv('HANDSHAKE_QUEUE_SIZE', '512')),
+            queue_timeout=float(os.getenv('HANDSHAKE_QUEUE_TIMEOUT', '5')),
+            retry_after=float(os.getenv('HANDSHAKE_RETRY_AFTER', '2')),
+            sleep=sleep
+        )
+
+    # Handshake Admission
+    def acquire(self):
+        """Reserve a handshake slot, waiting in the queue if necessary.
+
+        Returns True when admitted, False when the queue is full, the wait
+        timed out or the server started draining.
+        """
+        with self._lock:
+            if self.draining:
+                return False
+            if self._active < self.max_handshakes:
+                self._active += 1
+                return True
+            if self._queued >= self.max_queue:
+                return False
+            self._queued += 1
+
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while time.monotonic() < deadline:
+                self._sleep(self.poll_interval)
+                with self._lock:
+                    if self.draining:
+                        return False
+                    if self._active < self.max_handshakes:
+                        self._active += 1
+                        return True
+            return False
+        finally:
+            with self._lock:
+                self._queued -= 1
+
+    async def acquire_async(self):
+        """Asyncio variant of acquire()"""
+        with self._lock:
+            if self.draining:
+                return False
+            if self._active < self.max_handshakes:
+                self._active += 1
+                return True
+            if self._queued >= self.max_queue:
+                return False
+            self._queued += 1
+
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                with self._lock:
+                    if self.draining:
+                        return False
+                    if self._active < self.max_handshakes:
+                        self._active += 1
+                        return True
+            return False
+        finally:
+            with self._lock:
+                self._queued -= 1
+
+    def release(self):
+        """Free a handshake slot"""
+        with self._lock:
+            self._active = max(0, self._active - 1)
+
+    @contextmanager
+    def handshake(self):
+        """Context manager yielding whether the handshake was admitted"""
+        admitted = self.acquire()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release()
+
+    @asynccontextmanager
+    async def handshake_async(self):
+        """Asyncio variant of handshake()"""
+        admitted = await self.acquire_async()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release()
+
+    def retry_hint(self):
+        """Suggested client back-off in seconds, scaled by queue pressure"""
+        with self._lock:
+            pressure = self._queued / self.max_queue if self.max_queue else 1.0
+        return round(self.retry_after * (1 + pressure) + random.uniform(0, self.retry_after), 2)
+
+    # Pending Writes
+    def pending_write(self):
+        """Count a write as pending, returns the callable that completes it"""
+        with self._lock:
+            self._pending_writes += 1
+
+        def done():
+            with self._lock:
+                self._pending_writes -= 1
+        return done
+
+    @contextmanager
+    def write(self):
+        """Track a datastore write so drain can wait for it to finish"""
+        done = self.pending_write()
+        try:
+            yield
+        finally:
+            done()
+
+    # Drain
+    def start_drain(self):
+        """Stop admitting new connections"""
+        with self._lock:
+            self.draining = True
+
+    def reconnect_delay(self, window):
+        """Jittered reconnect delay spread across the drain window"""
+        return round(random.uniform(self.retry_after, self.retry_after + window), 2)
+
+    def wait_for_writes(self, timeout):
+        """Wait until in-flight writes complete, returns True if flushed"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._pending_writes == 0:
+                    return True
+            self._sleep(self.poll_interval)
+        with self._lock:
+            return self._pending_writes == 0
+
+    async def wait_for_writes_async(self, timeout):
+        """Asyncio variant of wait_for_writes()"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._pending_writes == 0:
+                    return True
+            await asyncio.sleep(self.poll_interval)
+        with self._lock:
+            return self._pending_writes == 0
+
+    def stats(self):
+        """Snapshot of admission counters"""
+        with self._lock:
+            return {
+                'active_handshakes': self._active,
+                'queued_handshakes': self._queued,
+                'pending_writes': self._pending_writes,
+                'draining': self.draining
+            }
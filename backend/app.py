@@ -1,16 +1,21 @@
 import os
 from flask import Flask, request
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask_socketio import SocketIO, ConnectionRefusedError, emit, join_room, leave_room
 from flask_cors import CORS
-from collections import deque
-import uuid
-import time
 
 from dotenv import load_dotenv
 load_dotenv()
 
 from firebase_config import firebase_config
-from database import db_service
+from database import DatabaseService
+from db_executor import DatastoreExecutor, DatastoreUnavailable, GuardedDatabaseService
+from admission import AdmissionController
+from chat_state import ChatState, DEFAULT_ROOM, HISTORY_LIMIT
+from dedup import write_id
+from retention import compact_rooms
+from wire import encode_rows, negotiate
+from sharding import ShardUnavailable, invalid_payload
+from profiling import ProfilerBusy, SamplingProfiler, authorized
 
 app = Flask(__name__)
 
@@ -20,23 +25,56 @@ cors_origins = os.getenv('CORS_ORIGINS', 'http://localhost:3000,http://localhost
 CORS(app, origins=cors_origins)
 
 async_mode = os.getenv('SOCKETIO_ASYNC_MODE', 'eventlet')
-socketio = SocketIO(app, cors_allowed_origins=cors_origins, async_mode=async_mode)
+# Shared broker (e.g. redis://localhost:6379/0) so emits reach clients on every worker
+message_queue = os.getenv('SOCKETIO_MESSAGE_QUEUE') or None
+# Websocket permessage-deflate is negotiated by the server when the client offers it;
+# these cover the long-polling transport
+socketio = SocketIO(app, cors_allowed_origins=cors_origins, async_mode=async_mode,
+                    message_queue=message_queue,
+                    http_compression=os.getenv('HTTP_COMPRESSION', '1') == '1',
+                    compression_threshold=int(os.getenv('COMPRESSION_THRESHOLD', '1024')))
 
 DEV_MODE = os.getenv('DEV_MODE', '0') == '1'
 USE_FIREBASE = os.getenv('USE_FIREBASE', '1') == '1'
 
 if USE_FIREBASE:
-    firebase_config.initialize()
+    # The SDK is loaded by warm_firebase() once the server is up, or on first use
     print("Firebase integration enabled")
 else:
     print("Running in local mode without Firebase")
 
-messages = deque(maxlen=1000)
-connected_users = {}
-typing_users = set()
-dm_rooms = {}
+# Handlers reach Firestore through a bounded pool with timeouts and a circuit breaker
+datastore = GuardedDatabaseService(DatabaseService(raise_errors=True), DatastoreExecutor.from_env(socketio.async_mode))
 
-DEFAULT_ROOM = "general"
+def broadcast(event, data, room):
+    """Emit from timer handlers, which run outside any request"""
+    socketio.emit(event, data, to=room)
+
+# Sessions, rooms, DMs, typing, sequencing and dedup shared with asgi_app.py.
+# Per-room retention: RETENTION_MAX_MESSAGES / RETENTION_MAX_AGE by default,
+# overridden per room pattern by ROOM_RETENTION (e.g. "general=1000:7d,dm_*=500:30d");
+# sharded room ownership across workers from SHARD_ID / SHARD_PEERS
+chat = ChatState.from_env(USE_FIREBASE, broadcast, dev_mode=DEV_MODE)
+retention = chat.retention
+RETENTION_COMPACT_INTERVAL = float(os.getenv('RETENTION_COMPACT_INTERVAL', '300'))
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '200'))
+RETENTION_ARCHIVE = os.getenv('RETENTION_ARCHIVE', '0') == '1'
+EVENT_LOG_FSYNC_INTERVAL = float(os.getenv('EVENT_LOG_FSYNC_INTERVAL', '0.05'))
+
+if chat.shards and not message_queue:
+    print("WARNING: Sharding enabled without SOCKETIO_MESSAGE_QUEUE, broadcasts stay on the owning worker")
+
+# Connection admission control and graceful drain
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '10'))
+DRAIN_RECONNECT_WINDOW = float(os.getenv('DRAIN_RECONNECT_WINDOW', '30'))
+admission = AdmissionController.from_env(sleep=socketio.sleep)
+# Datastore writes stay pending until the pool finishes them, even past their timeout
+datastore.track_writes(admission)
+
+# On-demand CPU and allocation profiling, admin only (X-Admin-Token: PROFILE_TOKEN)
+profiler = SamplingProfiler.from_env()
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
 
 @app.route('/')
 def index():
@@ -44,7 +82,216 @@ def index():
 
 @app.route('/health')
 def health():
-    return {"status": "healthy", "connected_users": len(connected_users)}
+    if admission.draining:
+        return {"status": "draining", "connected_users": len(chat.connected_users)}, 503
+    return {"status": "healthy", **chat.stats(), "admission": admission.stats(),
+            "datastore": datastore.executor.stats()}
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """Sample CPU stacks and allocations for ?seconds=N"""
+    if not authorized(request.headers.get('X-Admin-Token'), PROFILE_TOKEN):
+        return {"error": "Not found"}, 404
+    try:
+        seconds = min(float(request.args.get('seconds', '10')), PROFILE_MAX_SECONDS)
+    except ValueError:
+        return {"error": "seconds must be a number"}, 400
+    try:
+        report = profiler.run(seconds, sleep=socketio.sleep, allocations=request.args.get('alloc', '1') == '1')
+    except ProfilerBusy as e:
+        return {"error": str(e)}, 409
+    if request.args.get('format') == 'collapsed':
+        return report['collapsed'] + '\n', 200, {'Content-Type': 'text/plain'}
+    return report
+
+@app.route('/internal/shard/<op>', methods=['POST'])
+def shard_rpc(op):
+    """Room operations forwarded by other shards"""
+    if not chat.shards or not chat.shards.authorized(request.headers.get('X-Shard-Secret')):
+        return {"error": "Forbidden"}, 403
+    handler = SHARD_OPS.get(op)
+    if handler is None:
+        return {"error": f"Unknown shard operation {op}"}, 404
+    payload = request.get_json(silent=True) or {}
+    error = invalid_payload(op, payload)
+    if error:
+        return {"error": error}, 400
+    chat.shards.served()
+    try:
+        return {"result": handler(payload)}
+    except DatastoreUnavailable as e:
+        return {"error": str(e)}, 503
+
+def off_loop(func, *args):
+    """Run a blocking call on eventlet's native thread pool so the hub keeps serving"""
+    if socketio.async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args)
+    return func(*args)
+
+def compact_history():
+    """Apply retention policies to in-memory and persisted room history"""
+    removed = chat.compact_local()
+    off_loop(chat.compact_event_log)
+    if USE_FIREBASE:
+        removed += compact_rooms(datastore, retention, chat.compaction_rooms(),
+                                 batch_size=RETENTION_BATCH_SIZE, archive=RETENTION_ARCHIVE)
+    return removed
+
+def compaction_loop():
+    """Background job running compact_history every RETENTION_COMPACT_INTERVAL seconds"""
+    while not admission.draining:
+        socketio.sleep(RETENTION_COMPACT_INTERVAL)
+        try:
+            removed = compact_history()
+            if DEV_MODE and removed:
+                print(f"Retention compaction removed {removed} messages")
+        except Exception as e:
+            print(f"ERROR: Retention compaction failed: {e}")
+
+def sync_event_log():
+    """fsync the event log off the event loop"""
+    return off_loop(chat.event_log.sync)
+
+def event_log_loop():
+    """Background job batching event log fsyncs every EVENT_LOG_FSYNC_INTERVAL seconds"""
+    while not admission.draining:
+        socketio.sleep(EVENT_LOG_FSYNC_INTERVAL)
+        try:
+            sync_event_log()
+        except Exception as e:
+            print(f"ERROR: Event log fsync failed: {e}")
+
+def warm_firebase():
+    """Load the Firebase SDK off the event loop so the first handshake doesn't pay for it"""
+    return off_loop(firebase_config.initialize)
+
+def timer_loop():
+    """Background job firing expired timers every TIMER_TICK seconds"""
+    while not admission.draining:
+        socketio.sleep(chat.timers.tick)
+        chat.timers.run()
+
+def membership_loop():
+    """Background job broadcasting aggregated joins and leaves every MEMBERSHIP_WINDOW seconds"""
+    while not admission.draining:
+        socketio.sleep(chat.membership.window)
+        try:
+            for room, frame in chat.membership_frames():
+                socketio.emit('membership_delta', frame, to=room)
+        except Exception as e:
+            print(f"ERROR: Membership flush failed: {e}")
+
+def start_background_tasks():
+    socketio.start_background_task(timer_loop)
+    socketio.start_background_task(membership_loop)
+    if USE_FIREBASE:
+        socketio.start_background_task(warm_firebase)
+    if RETENTION_COMPACT_INTERVAL > 0:
+        socketio.start_background_task(compaction_loop)
+    if chat.event_log:
+        socketio.start_background_task(event_log_loop)
+
+def forward(room, op, payload, shard=None):
+    """Forward an operation to another shard off the event loop"""
+    return off_loop(chat.shards.forward, room, op, payload, shard)
+
+def route(room, op, payload):
+    """Run a room operation on the room's owning shard"""
+    if chat.owns(room):
+        return SHARD_OPS[op](payload)
+    return forward(room, op, payload)
+
+def room_history(payload):
+    """Recent messages of a room (owner side)"""
+    room, limit = payload['room'], payload.get('limit', HISTORY_LIMIT)
+    if USE_FIREBASE:
+        return datastore.get_recent_messages(room, limit, policy=retention.policy_for(room))
+    return chat.recent_messages(room, limit)
+
+def seq_seed(room):
+    """Newest stored message of a room; raises rather than seed from a degraded read"""
+    if USE_FIREBASE:
+        return datastore.get_seq_seed(room)
+    return chat.recent_messages(room, 1)
+
+def commit_message(message):
+    """Sequence, persist and broadcast a message (owner side)"""
+    room = message['room']
+    if not chat.owns(room) and not message.get('hops'):
+        # Ownership moved while the message was in flight
+        return forward(room, 'send', {**message, 'hops': 1})
+    sender, ack = chat.claim_send(message)
+    if ack['duplicate']:
+        return ack
+    
+    # Seed, sequence and store in Firestore and/or in-memory
+    try:
+        if room not in chat.sequencer:
+            chat.sequencer.restore(room, chat.last_seq(seq_seed(room)))
+        chat.assign_seq(message, ack)
+        if USE_FIREBASE:
+            # Retries of a timed-out write overwrite its document if it lands after all
+            saved_message = datastore.save_message(message.copy(), doc_id=write_id(sender, ack['client_msg_id']))
+            message.update(saved_message)
+        else:
+            chat.store_message(message)
+    except Exception:
+        chat.release_send(sender, ack)
+        raise
+    
+    # Through the message queue this reaches members connected to any worker
+    socketio.emit('new_message', message, to=room)
+    return ack
+
+def rebalance(payload):
+    """Apply a new peer list and hand rooms this shard no longer owns to their new owners"""
+    handed_off, failed = [], []
+    for owner, handoff in chat.rebalance(payload['peers']):
+        try:
+            forward(handoff['room'], 'handoff', handoff, shard=owner)
+        except ShardUnavailable as e:
+            # Kept here with its history and sequence, retried by the next rebalance
+            print(f"ERROR: {e}")
+            failed.append(handoff['room'])
+            continue
+        chat.handed_off(handoff['room'])
+        handed_off.append(handoff['room'])
+    print(f"Rebalanced to {len(chat.shards.peers)} shards, handed off {len(handed_off)} rooms, "
+          f"{len(failed)} failed")
+    return {'handed_off': sorted(handed_off), 'failed': sorted(failed)}
+
+SHARD_OPS = {
+    'send': commit_message,
+    'history': room_history,
+    'create_dm': chat.register_dm,
+    'dm_info': chat.dm_info,
+    'handoff': chat.handoff_room,
+    'rebalance': rebalance,
+}
+
+def drain():
+    """Stop accepting connections, ask clients to reconnect and flush pending writes"""
+    admission.start_drain()
+    print(f"Draining {len(chat.connected_users)} connections...")
+    
+    # Spread reconnects across the window so clients don't return all at once
+    for sid in list(chat.connected_users):
+        socketio.emit('server_draining', {
+            'message': 'Server is restarting',
+            'reconnect_after': admission.reconnect_delay(DRAIN_RECONNECT_WINDOW)
+        }, to=sid)
+    
+    if not admission.wait_for_writes(DRAIN_TIMEOUT):
+        print(f"WARNING: Drain timed out with writes still pending: {admission.stats()['pending_writes']}")
+    
+    for sid in list(chat.connected_users):
+        socketio.server.disconnect(sid)
+    
+    if chat.event_log:
+        sync_event_log()
+    
+    print("Drain complete")
 
 @socketio.on('connect')
 def handle_connect(auth):
@@ -52,62 +299,45 @@ def handle_connect(auth):
     if DEV_MODE:
         print(f"User connected: {request.sid}")
     
-    user_data = auth if auth else {}
+    if admission.draining:
+        raise ConnectionRefusedError({
+            'message': 'Server is restarting',
+            'retry_after': admission.reconnect_delay(DRAIN_RECONNECT_WINDOW)
+        })
     
-    # Firebase Authentication
-    if USE_FIREBASE and user_data.get('token'):
-        firebase_user = firebase_config.verify_token(user_data['token'])
-        if firebase_user:
-            # Authenticated Firebase user
-            username = firebase_user.get('name') or firebase_user.get('email', f'User_{request.sid[:8]}')
-            user_id = firebase_user['uid']
+    user_data = auth if auth else {}
+    wire = negotiate(user_data.get('wire', 'json'))
+    firebase_uid = None
+    
+    # Admission control: cap concurrent token verification and profile writes
+    with admission.handshake() as admitted:
+        if not admitted:
+            raise ConnectionRefusedError({
+                'message': 'Server busy',
+                'retry_after': admission.retry_hint()
+            })
+        
+        # Firebase Authentication
+        if USE_FIREBASE and user_data.get('token'):
+            # Key fetch and RSA verify (and SDK init if warm_firebase hasn't finished) block
+            firebase_user = off_loop(firebase_config.verify_token, user_data['token'])
+            if not firebase_user:
+                # Invalid Firebase token
+                emit('auth_error', {'message': 'Invalid authentication token'})
+                return False
             
             # Save/update user profile in Firestore
-            profile_data = {
-                'uid': user_id,
-                'email': firebase_user.get('email'),
-                'name': firebase_user.get('name'),
-                'picture': firebase_user.get('picture'),
-                'last_seen': time.time()
-            }
-            db_service.save_user_profile(profile_data)
+            username, user_id, profile_data = chat.firebase_identity(request.sid, firebase_user)
+            firebase_uid = user_id
+            datastore.save_user_profile(profile_data)
             
             if DEV_MODE:
                 print(f"Firebase user authenticated: {username} ({user_id})")
         else:
-            # Invalid Firebase token
-            emit('auth_error', {'message': 'Invalid authentication token'})
-            return False
-    else:
-        # Development mode or no Firebase token
-        if user_data.get('token', '').startswith('dev-token-'):
-            # Development token
-            username = user_data['token'].replace('dev-token-', '')
-            user_id = f'dev-user-{username}'
-            if DEV_MODE:
-                print(f"Dev token authenticated: {username}")
-        else:
-            # Fallback for no authentication
-            username = user_data.get('username', f'User_{request.sid[:8]}')
-            user_id = f'anonymous-{request.sid}'
-            if DEV_MODE:
-                print(f"👤 Anonymous user: {username}")
-    
-    # Store user info
-    connected_users[request.sid] = {
-        'username': username,
-        'user_id': user_id,
-        'joined_at': time.time(),
-        'room': None,
-        'firebase_uid': firebase_user.get('uid') if 'firebase_user' in locals() else None
-    }
-    
-    emit('connected', {
-        'message': 'Connected successfully',
-        'user_id': request.sid,
-        'username': username,
-        'firebase_uid': user_id
-    })
+            # Development token, or no authentication
+            username, user_id = chat.guest_identity(request.sid, user_data)
+    
+    emit('connected', chat.connect(request.sid, username, user_id, firebase_uid, wire))
     
     if DEV_MODE:
         print(f"User {username} authenticated with session {request.sid}")
@@ -115,185 +345,134 @@ def handle_connect(auth):
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle user disconnection"""
-    if request.sid in connected_users:
-        username = connected_users[request.sid]['username']
-        room = connected_users[request.sid].get('room')
-        
-        # Remove from typing users if present
-        typing_users.discard(request.sid)
-        
-        # Notify room about user leaving
-        if room:
-            emit('user_left', {
-                'username': username,
-                'message': f'{username} left the chat'
-            }, room=room)
-            
-            # Update typing indicators
-            emit('typing_update', {
-                'typing_users': [connected_users[uid]['username'] 
-                               for uid in typing_users 
-                               if uid in connected_users and connected_users[uid].get('room') == room]
-            }, room=room)
-        
-        del connected_users[request.sid]
-        print(f"User {username} disconnected")
+    # Leaves are not announced while draining, everyone is leaving
+    session = chat.disconnect(request.sid, announce=not admission.draining)
+    if session:
+        print(f"User {session.username} disconnected")
+
+def enter_thread(room):
+    """Move the current session into a chat room, leaving its previous one"""
+    old_room = chat.enter_room(request.sid, room)
+    if old_room:
+        leave_room(old_room)
+    join_room(room)
 
 @socketio.on('join_thread')
 def handle_join_thread(data):
     """Handle user joining a chat room"""
     room = data.get('room', DEFAULT_ROOM)
     
-    if request.sid not in connected_users:
+    if request.sid not in chat.connected_users:
         emit('error', {'message': 'User not authenticated'})
         return
     
-    username = connected_users[request.sid]['username']
-    old_room = connected_users[request.sid].get('room')
+    enter_thread(room)
     
-    # Leave old room if exists
-    if old_room and old_room != room:
-        leave_room(old_room)
-        emit('user_left', {
-            'username': username,
-            'message': f'{username} left the chat'
-        }, room=old_room)
-    
-    # Join new room
-    join_room(room)
-    connected_users[request.sid]['room'] = room
-    
-    # Get recent messages from Firestore or in-memory storage
-    if USE_FIREBASE:
-        room_messages = db_service.get_recent_messages(room, 50)
-    else:
-        # Fallback to in-memory storage
-        recent_messages = list(messages)[-50:]  # Last 50 messages
-        room_messages = [msg for msg in recent_messages if msg.get('room') == room]
+    # Get recent messages from the room's owning shard
+    try:
+        room_messages = route(room, 'history', {'room': room, 'limit': HISTORY_LIMIT})
+    except ShardUnavailable as e:
+        print(f"ERROR: {e}")
+        room_messages = []
     
     emit('joined_thread', {
         'room': room,
         'message': f'Joined {room}',
-        'recent_messages': room_messages
+        'recent_messages': encode_rows(room_messages, chat.wire_for(request.sid))
     })
     
-    # Notify others in the room
-    emit('user_joined', {
-        'username': username,
-        'message': f'{username} joined the chat'
-    }, room=room, include_self=False)
+    chat.announce_join(request.sid, room)
+
+@socketio.on('bootstrap')
+def handle_bootstrap(data=None):
+    """Join a room and return everything the first render needs in one event"""
+    if request.sid not in chat.connected_users:
+        emit('error', {'message': 'User not authenticated'})
+        return
+    
+    room = (data or {}).get('room', DEFAULT_ROOM)
+    enter_thread(room)
+    dm_ids = chat.user_dm_rooms(request.sid)
     
-    print(f"User {username} joined room {room}")
+    # Room and DM history plus DM unread counts, read concurrently
+    limits, local_limits = chat.history_limits(room, dm_ids)
+    if USE_FIREBASE:
+        history, stats = datastore.get_rooms_snapshot(local_limits, dm_ids, retention.policy_for)
+    else:
+        history = {r: chat.recent_messages(r, limit) for r, limit in local_limits.items()}
+        stats = None
+    
+    # Rooms owned by other shards
+    for r in limits.keys() - local_limits.keys():
+        try:
+            history[r] = forward(r, 'history', {'room': r, 'limit': limits[r]})
+        except ShardUnavailable as e:
+            print(f"ERROR: {e}")
+            history[r] = []
+    
+    emit('bootstrap', chat.bootstrap_event(request.sid, room, history, dm_ids, chat.unread_counts(dm_ids, stats)))
+    
+    chat.announce_join(request.sid, room)
 
 @socketio.on('send_message')
 def handle_send_message(data):
     """Handle sending a message to the room"""
-    if request.sid not in connected_users:
+    if request.sid not in chat.connected_users:
         emit('error', {'message': 'User not authenticated'})
         return
     
-    user_info = connected_users[request.sid]
-    room = user_info.get('room')
-    
-    if not room:
-        emit('error', {'message': 'Not in any room'})
-        return
-    
-    message_text = data.get('message', '').strip()
-    if not message_text:
-        emit('error', {'message': 'Message cannot be empty'})
+    message, error = chat.new_message(request.sid, data)
+    if error:
+        emit('error', {'message': error})
         return
     
-    # Create message object
-    message = {
-        'id': str(uuid.uuid4()),
-        'username': user_info['username'],
-        'message': message_text,
-        'room': room,
-        'timestamp': time.time(),
-        'user_id': request.sid,
-        'firebase_uid': user_info.get('firebase_uid')
-    }
-    
-    # Store message in Firestore and/or in-memory
-    if USE_FIREBASE:
-        # Save to Firestore
-        saved_message = db_service.save_message(message.copy())
-        message.update(saved_message)
-    else:
-        # Fallback to in-memory storage
-        messages.append(message)
-    
-    # Broadcast to room
-    emit('new_message', message, room=room)
+    # The room's owning shard sequences, stores and broadcasts it
+    try:
+        ack = route(message['room'], 'send', message)
+    except (ShardUnavailable, DatastoreUnavailable) as e:
+        print(f"ERROR: {e}")
+        emit('error', {'message': 'Room is temporarily unavailable, please retry'})
+        return {'error': 'unavailable', 'retry': True}
     
     if DEV_MODE:
-        print(f"💬 Message from {user_info['username']} in {room}: {message_text}")
+        print(f"💬 Message from {message['username']} in {message['room']}: {message['message']}")
+    
+    # Sent as the Socket.IO acknowledgement when the client asked for one
+    return ack
 
 @socketio.on('typing')
 def handle_typing(data):
     """Handle typing indicators"""
-    if request.sid not in connected_users:
+    session = chat.connected_users.get(request.sid)
+    if session is None or not session.room:
         return
     
-    user_info = connected_users[request.sid]
-    room = user_info.get('room')
-    
-    if not room:
-        return
-    
-    is_typing = data.get('typing', False)
-    
-    if is_typing:
-        typing_users.add(request.sid)
-    else:
-        typing_users.discard(request.sid)
-    
-    # Get typing users in the same room
-    room_typing_users = [
-        connected_users[uid]['username'] 
-        for uid in typing_users 
-        if uid in connected_users and connected_users[uid].get('room') == room
-    ]
+    chat.set_typing(request.sid, data.get('typing', False))
     
     # Broadcast typing update to room (excluding self)
     emit('typing_update', {
-        'typing_users': room_typing_users
-    }, room=room, include_self=False)
+        'typing_users': chat.room_typing_users(session.room)
+    }, room=session.room, include_self=False)
 
 @socketio.on('get_room_info')
 def handle_get_room_info():
     """Get information about current room"""
-    if request.sid not in connected_users:
+    if request.sid not in chat.connected_users:
         emit('error', {'message': 'User not authenticated'})
         return
     
-    user_info = connected_users[request.sid]
-    room = user_info.get('room')
-    
+    room = chat.connected_users[request.sid].room
     if not room:
         emit('room_info', {'room': None, 'users': []})
         return
     
-    # Get users in the same room
-    room_users = [
-        {'username': user['username'], 'user_id': uid}
-        for uid, user in connected_users.items()
-        if user.get('room') == room
-    ]
-    
     # Get room statistics
     if USE_FIREBASE:
-        room_stats = db_service.get_room_stats(room)
-        total_messages = room_stats['total_messages']
+        total_messages = datastore.get_room_stats(room, policy=retention.policy_for(room))['total_messages']
     else:
-        total_messages = len([msg for msg in messages if msg.get('room') == room])
+        total_messages = chat.messages.count(room)
     
-    emit('room_info', {
-        'room': room,
-        'users': room_users,
-        'total_messages': total_messages
-    })
+    emit('room_info', chat.room_info(room, total_messages))
 
 @socketio.on('create_dm')
 def handle_create_dm(data):
@@ -309,51 +488,28 @@ def handle_create_dm(data):
         emit('error', {'message': 'Cannot create DM with yourself'})
         return
     
-    # Create DM room ID (sorted to ensure consistency)
-    dm_room_id = f"dm_{sorted([current_user_id, target_user_id])[0]}_{sorted([current_user_id, target_user_id])[1]}"
-    
-    # Store DM room info
-    dm_rooms[dm_room_id] = {
-        'participants': [current_user_id, target_user_id],
-        'created_at': time.time(),
-        'last_message_at': time.time()
-    }
+    # Store DM room info, registered with the shard owning the DM room
+    dm_room_id = chat.create_dm(current_user_id, target_user_id)
+    try:
+        route(dm_room_id, 'create_dm', {'dm_room_id': dm_room_id, 'info': chat.dm_rooms[dm_room_id]})
+    except ShardUnavailable as e:
+        print(f"WARNING: {e}")
     
     # Join both users to the DM room
     join_room(dm_room_id)
     
-    # Get user info
-    current_user = connected_users.get(current_user_id, {})
-    target_user = connected_users.get(target_user_id, {})
-    
+    current_user = chat.participant(current_user_id)
     emit('dm_created', {
         'dm_room_id': dm_room_id,
-        'participants': [
-            {
-                'user_id': current_user_id,
-                'username': current_user.get('username', 'Unknown'),
-                'firebase_uid': current_user.get('firebase_uid')
-            },
-            {
-                'user_id': target_user_id,
-                'username': target_user.get('username', 'Unknown'),
-                'firebase_uid': target_user.get('firebase_uid')
-            }
-        ]
+        'participants': [current_user, chat.participant(target_user_id)]
     })
     
     # Notify the target user about the DM
-    emit('dm_invitation', {
-        'dm_room_id': dm_room_id,
-        'from_user': {
-            'user_id': current_user_id,
-            'username': current_user.get('username', 'Unknown'),
-            'firebase_uid': current_user.get('firebase_uid')
-        }
-    }, room=target_user_id)
+    emit('dm_invitation', {'dm_room_id': dm_room_id, 'from_user': current_user}, room=target_user_id)
     
     if DEV_MODE:
-        print(f"DM room created: {dm_room_id} between {current_user.get('username')} and {target_user.get('username')}")
+        print(f"DM room created: {dm_room_id} between {current_user['username']} and "
+              f"{chat.participant(target_user_id)['username']}")
 
 @socketio.on('join_dm')
 def handle_join_dm(data):
@@ -365,120 +521,75 @@ def handle_join_dm(data):
         emit('error', {'message': 'DM room ID is required'})
         return
     
-    if dm_room_id not in dm_rooms:
-        emit('error', {'message': 'DM room not found'})
-        return
-    
-    # Check if user is a participant
-    if current_user_id not in dm_rooms[dm_room_id]['participants']:
-        emit('error', {'message': 'You are not a participant in this DM'})
+    if chat.dm_known_elsewhere(dm_room_id):
+        # Created through another worker
+        try:
+            info = forward(dm_room_id, 'dm_info', {'dm_room_id': dm_room_id})
+        except ShardUnavailable as e:
+            print(f"ERROR: {e}")
+            info = None
+        if info:
+            chat.dm_rooms[dm_room_id] = info
+    
+    # Check the room exists and the user is a participant
+    error = chat.dm_join_error(current_user_id, dm_room_id)
+    if error:
+        emit('error', {'message': error})
         return
     
     # Join the DM room
     join_room(dm_room_id)
     
-    # Get recent messages for this DM
-    if USE_FIREBASE:
-        try:
-            room_messages = db_service.get_recent_messages(dm_room_id, limit=50)
-            emit('room_messages', {
-                'room': dm_room_id,
-                'messages': room_messages
-            })
-        except Exception as e:
-            print(f"ERROR: Error retrieving DM messages: {e}")
-            emit('room_messages', {
-                'room': dm_room_id,
-                'messages': []
-            })
-    else:
-        # Get messages from in-memory storage
-        room_messages = [msg for msg in messages if msg.get('room') == dm_room_id]
-        room_messages.sort(key=lambda x: x.get('timestamp', 0))
-        
-        emit('room_messages', {
-            'room': dm_room_id,
-            'messages': room_messages[-50:]  # Last 50 messages
-        })
+    # Get recent messages for this DM from its owning shard
+    try:
+        room_messages = route(dm_room_id, 'history', {'room': dm_room_id, 'limit': HISTORY_LIMIT})
+    except Exception as e:
+        print(f"ERROR: Error retrieving DM messages: {e}")
+        room_messages = []
+    emit('room_messages', {
+        'room': dm_room_id,
+        'messages': encode_rows(room_messages, chat.wire_for(current_user_id))
+    })
     
     # Update user's current room
-    if current_user_id in connected_users:
-        connected_users[current_user_id]['room'] = dm_room_id
+    if current_user_id in chat.connected_users:
+        chat.connected_users[current_user_id].room = dm_room_id
     
     if DEV_MODE:
-        user_info = connected_users.get(current_user_id, {})
-        print(f"User {user_info.get('username', 'Unknown')} joined DM room {dm_room_id}")
+        print(f"User {chat.participant(current_user_id)['username']} joined DM room {dm_room_id}")
 
 @socketio.on('get_dm_list')
 def handle_get_dm_list():
     """Get list of DM rooms for the current user"""
     current_user_id = request.sid
+    dm_ids = chat.user_dm_rooms(current_user_id)
     
-    # Find all DM rooms where the user is a participant
-    user_dms = []
-    for dm_room_id, dm_info in dm_rooms.items():
-        if current_user_id in dm_info['participants']:
-            # Get the other participant
-            other_participant_id = [pid for pid in dm_info['participants'] if pid != current_user_id][0]
-            other_user = connected_users.get(other_participant_id, {})
-            
-            # Count unread messages (simplified - in real app, track read status)
-            if USE_FIREBASE:
-                try:
-                    room_stats = db_service.get_room_stats(dm_room_id)
-                    unread_count = room_stats.get('total_messages', 0)
-                except:
-                    unread_count = 0
-            else:
-                room_messages = [msg for msg in messages if msg.get('room') == dm_room_id]
-                unread_count = len(room_messages)
-            
-            user_dms.append({
-                'dm_room_id': dm_room_id,
-                'other_user': {
-                    'user_id': other_participant_id,
-                    'username': other_user.get('username', 'Unknown'),
-                    'firebase_uid': other_user.get('firebase_uid'),
-                    'online': other_participant_id in connected_users
-                },
-                'last_message_at': dm_info['last_message_at'],
-                'unread_count': unread_count
-            })
-    
-    # Sort by last message time
-    user_dms.sort(key=lambda x: x['last_message_at'], reverse=True)
+    if USE_FIREBASE:
+        _, stats = datastore.get_rooms_snapshot({}, dm_ids, retention.policy_for)
+    else:
+        stats = None
+    user_dms = chat.dm_summaries(current_user_id, chat.unread_counts(dm_ids, stats))
     
-    emit('dm_list', {'dms': user_dms})
+    emit('dm_list', {'dms': encode_rows(user_dms, chat.wire_for(current_user_id))})
     
     if DEV_MODE:
-        user_info = connected_users.get(current_user_id, {})
-        print(f"Sent DM list to {user_info.get('username', 'Unknown')}: {len(user_dms)} DMs")
+        print(f"Sent DM list to {chat.participant(current_user_id)['username']}: {len(user_dms)} DMs")
 
 @socketio.on('get_online_users')
 def handle_get_online_users():
     """Get list of online users for DM creation"""
     current_user_id = request.sid
+    online_users = chat.online_user_list(current_user_id)
     
-    online_users = []
-    for uid, user_info in connected_users.items():
-        if uid != current_user_id:  # Exclude self
-            online_users.append({
-                'user_id': uid,
-                'username': user_info.get('username', 'Unknown'),
-                'firebase_uid': user_info.get('firebase_uid'),
-                'last_seen': user_info.get('joined_at', time.time())
-            })
-    
-    # Sort by username
-    online_users.sort(key=lambda x: x['username'])
-    
-    emit('online_users', {'users': online_users})
+    emit('online_users', {'users': encode_rows(online_users, chat.wire_for(current_user_id))})
     
     if DEV_MODE:
-        user_info = connected_users.get(current_user_id, {})
-        print(f"Sent online users list to {user_info.get('username', 'Unknown')}: {len(online_users)} users")
+        print(f"Sent online users list to {chat.participant(current_user_id)['username']}: {len(online_users)} users")
 
 if __name__ == '__main__':
     print("Starting Flask-SocketIO server...")
     print(f"Default room: {DEFAULT_ROOM}")
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
+    start_background_tasks()
+    # Under eventlet the reloader serves from another thread, whose hub never runs the background tasks
+    socketio.run(app, debug=True, host='0.0.0.0', port=5000,
+                 use_reloader=socketio.async_mode != 'eventlet')
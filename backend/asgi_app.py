@@ -0,0 +1,618 @@
+"""
+Asyncio Server Mode - python-socketio AsyncServer on an ASGI server
+
+Same events and payloads as app.py, but handlers are coroutines and every
+blocking Firebase/Firestore call is offloaded to the bounded thread pool
+in blocking.py. Chat state and the payloads built from it live in
+chat_state.py, shared with app.py. Run with SERVER_MODE=asgi python run.py,
+or directly:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+
+import json
+import os
+from urllib.parse import parse_qs
+
+import socketio
+from socketio.exceptions import ConnectionRefusedError
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from blocking import run_blocking
+from firebase_config import firebase_config
+from async_database import async_db_service
+from db_executor import DatastoreUnavailable
+from admission import AdmissionController
+from chat_state import ChatState, DEFAULT_ROOM, HISTORY_LIMIT
+from dedup import write_id
+from retention import compaction_targets
+from wire import encode_rows, negotiate
+from sharding import ShardUnavailable, invalid_payload
+from profiling import ProfilerBusy, SamplingProfiler, authorized
+
+cors_origins = os.getenv('CORS_ORIGINS', 'http://localhost:3000,http://localhost:5173').split(',')
+
+# Shared broker (e.g. redis://localhost:6379/0) so emits reach clients on every worker
+message_queue = os.getenv('SOCKETIO_MESSAGE_QUEUE') or None
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins=cors_origins,
+                           client_manager=socketio.AsyncRedisManager(message_queue) if message_queue else None,
+                           http_compression=os.getenv('HTTP_COMPRESSION', '1') == '1',
+                           compression_threshold=int(os.getenv('COMPRESSION_THRESHOLD', '1024')))
+
+DEV_MODE = os.getenv('DEV_MODE', '0') == '1'
+USE_FIREBASE = os.getenv('USE_FIREBASE', '1') == '1'
+
+if USE_FIREBASE:
+    # The SDK is loaded by warm_firebase() once the server is up, or on first use
+    print("Firebase integration enabled")
+else:
+    print("Running in local mode without Firebase")
+
+
+def broadcast(event, data, room):
+    """Emit from synchronous code (timer handlers) as a background task"""
+    sio.start_background_task(sio.emit, event, data, room=room)
+
+
+chat = ChatState.from_env(USE_FIREBASE, broadcast, dev_mode=DEV_MODE)
+retention = chat.retention
+RETENTION_COMPACT_INTERVAL = float(os.getenv('RETENTION_COMPACT_INTERVAL', '300'))
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '200'))
+RETENTION_ARCHIVE = os.getenv('RETENTION_ARCHIVE', '0') == '1'
+EVENT_LOG_FSYNC_INTERVAL = float(os.getenv('EVENT_LOG_FSYNC_INTERVAL', '0.05'))
+
+if chat.shards and not message_queue:
+    print("WARNING: Sharding enabled without SOCKETIO_MESSAGE_QUEUE, broadcasts stay on the owning worker")
+
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '10'))
+DRAIN_RECONNECT_WINDOW = float(os.getenv('DRAIN_RECONNECT_WINDOW', '30'))
+admission = AdmissionController.from_env()
+# Datastore writes stay pending until the pool finishes them, even past their timeout
+async_db_service.track_writes(admission)
+
+# On-demand CPU and allocation profiling, admin only (X-Admin-Token: PROFILE_TOKEN)
+profiler = SamplingProfiler.from_env()
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+
+
+async def admin_profile(scope):
+    """Sample CPU stacks and allocations for ?seconds=N"""
+    headers = dict(scope['headers'])
+    if not authorized(headers.get(b'x-admin-token', b'').decode(), PROFILE_TOKEN):
+        return 404, {"error": "Not found"}
+    query = {k: v[-1] for k, v in parse_qs(scope['query_string'].decode()).items()}
+    try:
+        seconds = min(float(query.get('seconds', '10')), PROFILE_MAX_SECONDS)
+    except ValueError:
+        return 400, {"error": "seconds must be a number"}
+    try:
+        profiler.start(allocations=query.get('alloc', '1') == '1')
+    except ProfilerBusy as e:
+        return 409, {"error": str(e)}
+    try:
+        await sio.sleep(seconds)
+    finally:
+        report = await run_blocking(profiler.stop)
+    if query.get('format') == 'collapsed':
+        return 200, report['collapsed'] + '\n'
+    return 200, report
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        event = await receive()
+        body += event.get('body', b'')
+        if not event.get('more_body'):
+            return body
+
+
+async def shard_rpc(scope, receive):
+    """Room operations forwarded by other shards"""
+    headers = dict(scope['headers'])
+    if not chat.shards or not chat.shards.authorized(headers.get(b'x-shard-secret', b'').decode()):
+        return 403, {"error": "Forbidden"}
+    op = scope['path'][len('/internal/shard/'):]
+    handler = SHARD_OPS.get(op)
+    if handler is None or scope['method'] != 'POST':
+        return 404, {"error": f"Unknown shard operation {op}"}
+    try:
+        payload = json.loads(await read_body(receive) or b'{}')
+    except ValueError:
+        return 400, {"error": "Invalid JSON"}
+    error = invalid_payload(op, payload)
+    if error:
+        return 400, {"error": error}
+    chat.shards.served()
+    try:
+        return 200, {"result": await handler(payload)}
+    except DatastoreUnavailable as e:
+        return 503, {"error": str(e)}
+
+
+async def http_app(scope, receive, send):
+    """Plain HTTP routes served next to Socket.IO"""
+    if scope['type'] != 'http':
+        return
+    if scope['path'].startswith('/internal/shard/'):
+        status, body = await shard_rpc(scope, receive)
+    elif scope['path'] == '/admin/profile':
+        status, body = await admin_profile(scope)
+    elif scope['path'] == '/':
+        status, body = 200, {"status": "ASGI Socket.IO server running", "room": DEFAULT_ROOM}
+    elif scope['path'] == '/health':
+        if admission.draining:
+            status, body = 503, {"status": "draining", "connected_users": len(chat.connected_users)}
+        else:
+            status, body = 200, {"status": "healthy", **chat.stats(), "admission": admission.stats(),
+                                 "datastore": async_db_service.executor.stats()}
+    else:
+        status, body = 404, {"error": "Not found"}
+    if isinstance(body, str):
+        payload, content_type = body.encode(), b'text/plain'
+    else:
+        payload, content_type = json.dumps(body).encode(), b'application/json'
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type),
+                            (b'content-length', str(len(payload)).encode())]})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def compact_history():
+    """Apply retention policies to in-memory and persisted room history"""
+    # In-memory history is only touched on the loop; just the event log's file I/O goes to the pool
+    removed = chat.compact_local()
+    await run_blocking(chat.compact_event_log)
+    if USE_FIREBASE:
+        for room, policy in compaction_targets(retention, chat.compaction_rooms()):
+            removed += await async_db_service.compact_room(room, policy, batch_size=RETENTION_BATCH_SIZE,
+                                                           archive=RETENTION_ARCHIVE)
+    return removed
+
+
+async def compaction_loop():
+    """Background job running compact_history every RETENTION_COMPACT_INTERVAL seconds"""
+    while not admission.draining:
+        await sio.sleep(RETENTION_COMPACT_INTERVAL)
+        try:
+            removed = await compact_history()
+            if DEV_MODE and removed:
+                print(f"Retention compaction removed {removed} messages")
+        except Exception as e:
+            print(f"ERROR: Retention compaction failed: {e}")
+
+
+async def event_log_loop():
+    """Background job batching event log fsyncs every EVENT_LOG_FSYNC_INTERVAL seconds"""
+    while not admission.draining:
+        await sio.sleep(EVENT_LOG_FSYNC_INTERVAL)
+        try:
+            await run_blocking(chat.event_log.sync)
+        except Exception as e:
+            print(f"ERROR: Event log fsync failed: {e}")
+
+
+async def warm_firebase():
+    """Load the Firebase SDK off the event loop so the first handshake doesn't pay for it"""
+    await run_blocking(firebase_config.initialize)
+
+
+async def timer_loop():
+    """Background job firing expired timers every TIMER_TICK seconds"""
+    while not admission.draining:
+        await sio.sleep(chat.timers.tick)
+        chat.timers.run()
+
+
+async def membership_loop():
+    """Background job broadcasting aggregated joins and leaves every MEMBERSHIP_WINDOW seconds"""
+    while not admission.draining:
+        await sio.sleep(chat.membership.window)
+        try:
+            for room, frame in chat.membership_frames():
+                await sio.emit('membership_delta', frame, room=room)
+        except Exception as e:
+            print(f"ERROR: Membership flush failed: {e}")
+
+
+def start_background_tasks():
+    sio.start_background_task(timer_loop)
+    sio.start_background_task(membership_loop)
+    if USE_FIREBASE:
+        sio.start_background_task(warm_firebase)
+    if RETENTION_COMPACT_INTERVAL > 0:
+        sio.start_background_task(compaction_loop)
+    if chat.event_log:
+        sio.start_background_task(event_log_loop)
+
+
+async def forward(room, op, payload, shard=None):
+    """Forward an operation to another shard off the event loop"""
+    return await run_blocking(chat.shards.forward, room, op, payload, shard)
+
+
+async def route(room, op, payload):
+    """Run a room operation on the room's owning shard"""
+    if chat.owns(room):
+        return await SHARD_OPS[op](payload)
+    return await forward(room, op, payload)
+
+
+async def room_history(payload):
+    """Recent messages of a room (owner side)"""
+    room, limit = payload['room'], payload.get('limit', HISTORY_LIMIT)
+    if USE_FIREBASE:
+        return await async_db_service.get_recent_messages(room, limit, policy=retention.policy_for(room))
+    return chat.recent_messages(room, limit)
+
+
+async def seq_seed(room):
+    """Newest stored message of a room; raises rather than seed from a degraded read"""
+    if USE_FIREBASE:
+        return await async_db_service.get_seq_seed(room)
+    return chat.recent_messages(room, 1)
+
+
+async def commit_message(message):
+    """Sequence, persist and broadcast a message (owner side)"""
+    room = message['room']
+    if not chat.owns(room) and not message.get('hops'):
+        # Ownership moved while the message was in flight
+        return await forward(room, 'send', {**message, 'hops': 1})
+    sender, ack = chat.claim_send(message)
+    if ack['duplicate']:
+        return ack
+
+    try:
+        if room not in chat.sequencer:
+            chat.sequencer.restore(room, chat.last_seq(await seq_seed(room)))
+        chat.assign_seq(message, ack)
+        if USE_FIREBASE:
+            # Retries of a timed-out write overwrite its document if it lands after all
+            saved_message = await async_db_service.save_message(message.copy(), doc_id=write_id(sender, ack['client_msg_id']))
+            message.update(saved_message)
+        else:
+            chat.store_message(message)
+    except Exception:
+        chat.release_send(sender, ack)
+        raise
+
+    # Through the message queue this reaches members connected to any worker
+    await sio.emit('new_message', message, room=room)
+    return ack
+
+
+async def register_dm(payload):
+    return chat.register_dm(payload)
+
+
+async def dm_info(payload):
+    return chat.dm_info(payload)
+
+
+async def handoff_room(payload):
+    return chat.handoff_room(payload)
+
+
+async def rebalance(payload):
+    """Apply a new peer list and hand rooms this shard no longer owns to their new owners"""
+    handed_off, failed = [], []
+    for owner, handoff in chat.rebalance(payload['peers']):
+        try:
+            await forward(handoff['room'], 'handoff', handoff, shard=owner)
+        except ShardUnavailable as e:
+            # Kept here with its history and sequence, retried by the next rebalance
+            print(f"ERROR: {e}")
+            failed.append(handoff['room'])
+            continue
+        chat.handed_off(handoff['room'])
+        handed_off.append(handoff['room'])
+    print(f"Rebalanced to {len(chat.shards.peers)} shards, handed off {len(handed_off)} rooms, "
+          f"{len(failed)} failed")
+    return {'handed_off': sorted(handed_off), 'failed': sorted(failed)}
+
+
+SHARD_OPS = {
+    'send': commit_message,
+    'history': room_history,
+    'create_dm': register_dm,
+    'dm_info': dm_info,
+    'handoff': handoff_room,
+    'rebalance': rebalance,
+}
+
+
+async def drain():
+    """Stop accepting connections, ask clients to reconnect and flush pending writes"""
+    admission.start_drain()
+    print(f"Draining {len(chat.connected_users)} connections...")
+
+    for sid in list(chat.connected_users):
+        await sio.emit('server_draining', {
+            'message': 'Server is restarting',
+            'reconnect_after': admission.reconnect_delay(DRAIN_RECONNECT_WINDOW)
+        }, to=sid)
+
+    if not await admission.wait_for_writes_async(DRAIN_TIMEOUT):
+        print(f"WARNING: Drain timed out with writes still pending: {admission.stats()['pending_writes']}")
+
+    for sid in list(chat.connected_users):
+        await sio.disconnect(sid)
+
+    if chat.event_log:
+        await run_blocking(chat.event_log.sync)
+
+    print("Drain complete")
+
+
+@sio.event
+async def connect(sid, environ, auth):
+    """Handle user connection and authentication"""
+    if DEV_MODE:
+        print(f"User connected: {sid}")
+
+    if admission.draining:
+        raise ConnectionRefusedError({
+            'message': 'Server is restarting',
+            'retry_after': admission.reconnect_delay(DRAIN_RECONNECT_WINDOW)
+        })
+
+    user_data = auth if auth else {}
+    wire = negotiate(user_data.get('wire', 'json'))
+    firebase_uid = None
+
+    async with admission.handshake_async() as admitted:
+        if not admitted:
+            raise ConnectionRefusedError({
+                'message': 'Server busy',
+                'retry_after': admission.retry_hint()
+            })
+
+        if USE_FIREBASE and user_data.get('token'):
+            firebase_user = await firebase_config.verify_token_async(user_data['token'])
+            if not firebase_user:
+                await sio.emit('auth_error', {'message': 'Invalid authentication token'}, to=sid)
+                return False
+
+            username, user_id, profile_data = chat.firebase_identity(sid, firebase_user)
+            firebase_uid = user_id
+            await async_db_service.save_user_profile(profile_data)
+
+            if DEV_MODE:
+                print(f"Firebase user authenticated: {username} ({user_id})")
+        else:
+            username, user_id = chat.guest_identity(sid, user_data)
+
+    await sio.emit('connected', chat.connect(sid, username, user_id, firebase_uid, wire), to=sid)
+
+
+@sio.event
+async def disconnect(sid):
+    """Handle user disconnection"""
+    session = chat.disconnect(sid, announce=not admission.draining)
+    if session:
+        print(f"User {session.username} disconnected")
+
+
+def enter_thread(sid, room):
+    """Move a session into a chat room, leaving its previous one"""
+    old_room = chat.enter_room(sid, room)
+    if old_room:
+        sio.leave_room(sid, old_room)
+    sio.enter_room(sid, room)
+
+
+@sio.event
+async def join_thread(sid, data):
+    """Handle user joining a chat room"""
+    room = data.get('room', DEFAULT_ROOM)
+
+    if sid not in chat.connected_users:
+        await sio.emit('error', {'message': 'User not authenticated'}, to=sid)
+        return
+
+    enter_thread(sid, room)
+
+    try:
+        room_messages = await route(room, 'history', {'room': room, 'limit': HISTORY_LIMIT})
+    except ShardUnavailable as e:
+        print(f"ERROR: {e}")
+        room_messages = []
+
+    await sio.emit('joined_thread', {
+        'room': room,
+        'message': f'Joined {room}',
+        'recent_messages': encode_rows(room_messages, chat.wire_for(sid))
+    }, to=sid)
+
+    chat.announce_join(sid, room)
+
+
+@sio.event
+async def bootstrap(sid, data=None):
+    """Join a room and return everything the first render needs in one event"""
+    if sid not in chat.connected_users:
+        await sio.emit('error', {'message': 'User not authenticated'}, to=sid)
+        return
+
+    room = (data or {}).get('room', DEFAULT_ROOM)
+    enter_thread(sid, room)
+    dm_ids = chat.user_dm_rooms(sid)
+
+    limits, local_limits = chat.history_limits(room, dm_ids)
+    if USE_FIREBASE:
+        history, stats = await async_db_service.get_rooms_snapshot(local_limits, dm_ids, retention.policy_for)
+    else:
+        history = {r: chat.recent_messages(r, limit) for r, limit in local_limits.items()}
+        stats = None
+
+    for r in limits.keys() - local_limits.keys():
+        try:
+            history[r] = await forward(r, 'history', {'room': r, 'limit': limits[r]})
+        except ShardUnavailable as e:
+            print(f"ERROR: {e}")
+            history[r] = []
+
+    await sio.emit('bootstrap', chat.bootstrap_event(sid, room, history, dm_ids, chat.unread_counts(dm_ids, stats)),
+                   to=sid)
+
+    chat.announce_join(sid, room)
+
+
+@sio.event
+async def send_message(sid, data):
+    """Handle sending a message to the room"""
+    if sid not in chat.connected_users:
+        await sio.emit('error', {'message': 'User not authenticated'}, to=sid)
+        return
+
+    message, error = chat.new_message(sid, data)
+    if error:
+        await sio.emit('error', {'message': error}, to=sid)
+        return
+
+    try:
+        ack = await route(message['room'], 'send', message)
+    except (ShardUnavailable, DatastoreUnavailable) as e:
+        print(f"ERROR: {e}")
+        await sio.emit('error', {'message': 'Room is temporarily unavailable, please retry'}, to=sid)
+        return {'error': 'unavailable', 'retry': True}
+
+    if DEV_MODE:
+        print(f"💬 Message from {message['username']} in {message['room']}: {message['message']}")
+
+    return ack
+
+
+@sio.event
+async def typing(sid, data):
+    """Handle typing indicators"""
+    session = chat.connected_users.get(sid)
+    if session is None or not session.room:
+        return
+
+    chat.set_typing(sid, data.get('typing', False))
+
+    await sio.emit('typing_update', {
+        'typing_users': chat.room_typing_users(session.room)
+    }, room=session.room, skip_sid=sid)
+
+
+@sio.event
+async def get_room_info(sid, data=None):
+    """Get information about current room"""
+    if sid not in chat.connected_users:
+        await sio.emit('error', {'message': 'User not authenticated'}, to=sid)
+        return
+
+    room = chat.connected_users[sid].room
+    if not room:
+        await sio.emit('room_info', {'room': None, 'users': []}, to=sid)
+        return
+
+    if USE_FIREBASE:
+        room_stats = await async_db_service.get_room_stats(room, policy=retention.policy_for(room))
+        total_messages = room_stats['total_messages']
+    else:
+        total_messages = chat.messages.count(room)
+
+    await sio.emit('room_info', chat.room_info(room, total_messages), to=sid)
+
+
+@sio.event
+async def create_dm(sid, data):
+    """Create a direct message room between two users"""
+    target_user_id = data.get('target_user_id')
+
+    if not target_user_id:
+        await sio.emit('error', {'message': 'Target user ID is required'}, to=sid)
+        return
+
+    if target_user_id == sid:
+        await sio.emit('error', {'message': 'Cannot create DM with yourself'}, to=sid)
+        return
+
+    dm_room_id = chat.create_dm(sid, target_user_id)
+    try:
+        await route(dm_room_id, 'create_dm', {'dm_room_id': dm_room_id, 'info': chat.dm_rooms[dm_room_id]})
+    except ShardUnavailable as e:
+        print(f"WARNING: {e}")
+
+    sio.enter_room(sid, dm_room_id)
+
+    current_user = chat.participant(sid)
+    await sio.emit('dm_created', {
+        'dm_room_id': dm_room_id,
+        'participants': [current_user, chat.participant(target_user_id)]
+    }, to=sid)
+
+    await sio.emit('dm_invitation', {'dm_room_id': dm_room_id, 'from_user': current_user}, room=target_user_id)
+
+
+@sio.event
+async def join_dm(sid, data):
+    """Join a direct message room"""
+    dm_room_id = data.get('dm_room_id')
+
+    if not dm_room_id:
+        await sio.emit('error', {'message': 'DM room ID is required'}, to=sid)
+        return
+
+    if chat.dm_known_elsewhere(dm_room_id):
+        # Created through another worker
+        try:
+            info = await forward(dm_room_id, 'dm_info', {'dm_room_id': dm_room_id})
+        except ShardUnavailable as e:
+            print(f"ERROR: {e}")
+            info = None
+        if info:
+            chat.dm_rooms[dm_room_id] = info
+
+    error = chat.dm_join_error(sid, dm_room_id)
+    if error:
+        await sio.emit('error', {'message': error}, to=sid)
+        return
+
+    sio.enter_room(sid, dm_room_id)
+
+    try:
+        room_messages = await route(dm_room_id, 'history', {'room': dm_room_id, 'limit': HISTORY_LIMIT})
+    except Exception as e:
+        print(f"ERROR: Error retrieving DM messages: {e}")
+        room_messages = []
+
+    await sio.emit('room_messages', {
+        'room': dm_room_id,
+        'messages': encode_rows(room_messages, chat.wire_for(sid))
+    }, to=sid)
+
+    if sid in chat.connected_users:
+        chat.connected_users[sid].room = dm_room_id
+
+
+@sio.event
+async def get_dm_list(sid, data=None):
+    """Get list of DM rooms for the current user"""
+    dm_ids = chat.user_dm_rooms(sid)
+
+    if USE_FIREBASE:
+        _, stats = await async_db_service.get_rooms_snapshot({}, dm_ids, retention.policy_for)
+    else:
+        stats = None
+    user_dms = chat.dm_summaries(sid, chat.unread_counts(dm_ids, stats))
+
+    await sio.emit('dm_list', {'dms': encode_rows(user_dms, chat.wire_for(sid))}, to=sid)
+
+
+@sio.event
+async def get_online_users(sid, data=None):
+    """Get list of online users for DM creation"""
+    online_users = chat.online_user_list(sid)
+    await sio.emit('online_users', {'users': encode_rows(online_users, chat.wire_for(sid))}, to=sid)
+
+
+app = socketio.ASGIApp(sio, other_asgi_app=http_app, on_startup=start_background_tasks)
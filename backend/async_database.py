@@ -0,0 +1,10 @@
+"""
+Async Database Service for the asyncio (ASGI) server mode
+"""
+
+from database import DatabaseService
+from db_executor import DatastoreExecutor, GuardedDatabaseService
+
+
+# Global async database service instance (methods return awaitables)
+async_db_service = GuardedDatabaseService(DatabaseService(raise_errors=True), DatastoreExecutor.from_env('asyncio'))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Event log benchmark: append throughput with per-write vs batched fsync, and
+recovery (index rebuild + history restore) time
+
+    python benchmarks/bench_event_log.py [count]
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from event_log import EventLog
+from records import Message
+from retention import RetentionConfig, RoomHistory
+
+
+def message(i):
+    return Message(f'user-{i % 200}', f'message body number {i}', f'room-{i % 50}',
+                   time.time(), f'sid-{i % 200:016d}').to_dict()
+
+
+def append(directory, count, sync_every):
+    """Append count messages, fsyncing every sync_every appends; returns msg/s"""
+    log = EventLog(directory, segment_bytes=8 * 1024 * 1024)
+    start = time.perf_counter()
+    for i in range(count):
+        log.append_message(message(i))
+        if (i + 1) % sync_every == 0:
+            log.sync()
+    log.sync()
+    elapsed = time.perf_counter() - start
+    log.close()
+    return count / elapsed
+
+
+def recover(directory):
+    """Reopen the log and restore history; returns (seconds, restored messages)"""
+    start = time.perf_counter()
+    log = EventLog(directory)
+    restored = log.restore(RoomHistory(RetentionConfig.from_env()), {})
+    elapsed = time.perf_counter() - start
+    log.close()
+    return elapsed, restored
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    print(f"Messages: {count}")
+    print(f"{'fsync every':<14}{'msg/s':>12}")
+    for sync_every in (1, 64, 1024):
+        directory = tempfile.mkdtemp(prefix='event-log-')
+        try:
+            rate = append(directory, min(count, 2000) if sync_every == 1 else count, sync_every)
+            print(f"{sync_every:<14}{rate:>12.0f}")
+            if sync_every == 1024:
+                elapsed, restored = recover(directory)
+                print(f"Recovery: {elapsed * 1000:.0f} ms, {restored} messages restored")
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
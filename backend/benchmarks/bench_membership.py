@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Membership fan-out benchmark: per-user join/leave frames vs aggregated membership_delta
+
+Simulates a reconnect wave where every member of a room disconnects and
+reconnects within a few seconds, and counts frames delivered to clients.
+
+    python benchmarks/bench_membership.py [room_size] [wave_seconds]
+"""
+
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from membership import MembershipAggregator
+
+
+class _Session:
+    __slots__ = ('room',)
+
+    def __init__(self, room):
+        self.room = room
+
+
+def per_user_deliveries(room_size):
+    # Each leave sends user_left + typing_update, each join user_joined, to everyone in the room
+    return room_size * (2 * room_size) + room_size * room_size
+
+
+def aggregated_deliveries(room_size, wave_seconds, window):
+    aggregator = MembershipAggregator(window=window)
+    events = []
+    for i in range(room_size):
+        leave = random.uniform(0, wave_seconds)
+        events.append((leave, 'left', f'old-{i}'))
+        events.append((leave + random.uniform(0.5, 2.0), 'joined', f'new-{i}'))
+    events.sort()
+
+    sessions = [_Session('general') for _ in range(room_size)]
+    deliveries = frames = 0
+    now, index = 0.0, 0
+    while index < len(events):
+        now += window
+        while index < len(events) and events[index][0] <= now:
+            _, kind, user_id = events[index]
+            getattr(aggregator, kind)('general', user_id, user_id)
+            index += 1
+        for _, frame in aggregator.flush(sessions, lambda room: []):
+            frames += 1
+            deliveries += frame['member_count']
+    return frames, deliveries
+
+
+def main():
+    room_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    wave_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    random.seed(1)
+    print(f"Reconnect wave: {room_size} members over {wave_seconds}s")
+    print(f"{'strategy':<24}{'frames':>10}{'deliveries':>14}")
+    per_user = per_user_deliveries(room_size)
+    print(f"{'per-user events':<24}{room_size * 3:>10}{per_user:>14}")
+    for window in (0.25, 0.5, 1.0):
+        frames, deliveries = aggregated_deliveries(room_size, wave_seconds, window)
+        print(f"{f'delta, {window}s window':<24}{frames:>10}{deliveries:>14}")
+
+
+if __name__ == '__main__':
+    main()
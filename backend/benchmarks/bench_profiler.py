@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Profiler overhead: message-path throughput idle vs while sampling
+
+Builds Message records and encodes them for the compact wire format in a
+loop with the profiler idle, sampling stacks only (alloc=0), and sampling
+with tracemalloc allocation tracking.
+
+    python benchmarks/bench_profiler.py [seconds] [interval]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from profiling import SamplingProfiler
+from records import Message
+from wire import encode_rows
+
+
+def workload(seconds):
+    """Messages per second through record creation and encoding"""
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        rows = [Message(f'user-{i}', f'message {i}', 'general', time.time(), f'sid-{i}').to_dict()
+                for i in range(50)]
+        encode_rows(rows, 'compact')
+        done += len(rows)
+    return done / seconds
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    profiler = SamplingProfiler(interval=interval)
+
+    idle = workload(seconds)
+    print(f"{'profiler':<24}{'msgs/s':>12}{'overhead':>10}")
+    print(f"{'idle':<24}{idle:>12.0f}{'':>10}")
+    for label, allocations in (('sampling', False), ('sampling + tracemalloc', True)):
+        profiler.start(allocations)
+        active = workload(seconds)
+        report = profiler.stop()
+        print(f"{label:<24}{active:>12.0f}{(1 - active / idle) * 100:>9.1f}%")
+    print(f"\n{report['samples']} samples at {interval * 1000:.0f} ms, "
+          f"{len(report['collapsed'].splitlines())} unique stacks, top allocation sites:")
+    for entry in report['allocations'][:5]:
+        print(f"  {entry['size_kb']:>8} KiB  {entry['site']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Query cost report: read units per declared query against the mock Firestore
+
+Seeds a room, runs the DatabaseService operations the server uses and
+prints reads billed per query. Every query is also checked against
+firestore.indexes.json, so an undeclared composite index fails here.
+
+    python benchmarks/bench_query_costs.py [messages]
+"""
+
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from firebase_config import firebase_config, mock_query_stats
+from database import DatabaseService
+from retention import RetentionPolicy
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    # DatabaseService logs every read and write; keep only problems
+    log = io.StringIO()
+    with redirect_stdout(log):
+        firebase_config.initialize()
+        service = DatabaseService()
+        now = time.time()
+        for i in range(count):
+            service.save_message({'username': f'user-{i % 20}', 'message': f'message {i}', 'room': 'general',
+                                  'timestamp': now - (count - i), 'user_id': f'sid-{i % 20}'})
+
+        mock_query_stats.reset()
+        policy = RetentionPolicy(max_messages=count // 2, max_age=None)
+        service.get_recent_messages('general', 50, policy=policy)
+        service.get_room_stats('general', policy=policy)
+        service.get_online_users('general')
+        service.get_user_rooms('user-1')
+        service.compact_room('general', policy, batch_size=200)
+
+    for line in log.getvalue().splitlines():
+        if line.startswith(('ERROR', 'WARNING: Query')):
+            print(line)
+
+    print(f"Messages in room: {count}")
+    print(f"{'query':<22}{'runs':>6}{'reads':>10}{'max':>8}{'avg':>10}")
+    for name, entry in mock_query_stats.report().items():
+        print(f"{name:<22}{entry['executions']:>6}{entry['reads']:>10}{entry['max_reads']:>8}{entry['avg_reads']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark: bytes per session and per message, dict vs compact records
+
+    python benchmarks/bench_records.py [count]
+"""
+
+import sys
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from records import Session, Message
+
+
+def _text(i):
+    return f'message body number {i}'
+
+
+def dict_session(i):
+    return {
+        'username': f'user-{i % 2000}',
+        'user_id': f'dev-user-user-{i % 2000}',
+        'joined_at': time.time(),
+        'room': f'room-{i % 50}',
+        'firebase_uid': None
+    }
+
+
+def record_session(i):
+    return Session(f'user-{i % 2000}', f'dev-user-user-{i % 2000}', time.time(), f'room-{i % 50}')
+
+
+def dict_message(i):
+    return {
+        'id': str(uuid.uuid4()),
+        'username': f'user-{i % 2000}',
+        'message': _text(i),
+        'room': f'room-{i % 50}',
+        'timestamp': time.time(),
+        'user_id': f'sid-{i % 2000:016d}',
+        'firebase_uid': None
+    }
+
+
+def record_message(i):
+    return Message(f'user-{i % 2000}', _text(i), f'room-{i % 50}', time.time(), f'sid-{i % 2000:016d}')
+
+
+def measure(factory, count):
+    """Return bytes allocated per item for count items built by factory"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [factory(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return (after - before) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"Records: {count}")
+    print(f"{'':<10}{'dict':>12}{'record':>12}{'saving':>10}")
+    for name, as_dict, as_record in (
+        ('session', dict_session, record_session),
+        ('message', dict_message, record_message),
+    ):
+        d = measure(as_dict, count)
+        r = measure(as_record, count)
+        print(f"{name:<10}{d:>10.0f} B{r:>10.0f} B{(1 - r / d) * 100:>9.0f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark: Flask-SocketIO (eventlet) vs asyncio (ASGI) server mode
+
+Starts each server in a subprocess against the mock Firestore with a
+simulated round-trip latency, connects N clients to the general room and
+has every client send M messages. Reports connect time, send->broadcast
+latency and delivered messages per second.
+
+    python benchmarks/bench_server_modes.py [--clients 50] [--messages 20] [--latency-ms 20]
+
+Requires aiohttp for the benchmark client (pip install aiohttp).
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import socketio
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+MODES = {
+    'eventlet': {'SERVER_MODE': 'flask', 'SOCKETIO_ASYNC_MODE': 'eventlet'},
+    'asgi': {'SERVER_MODE': 'asgi'},
+}
+
+
+def start_server(mode, port, latency_ms):
+    env = dict(os.environ, **MODES[mode])
+    env.update({
+        'PORT': str(port),
+        'HOST': '127.0.0.1',
+        'DEV_MODE': '0',
+        'USE_FIREBASE': '1',
+        'GOOGLE_APPLICATION_CREDENTIALS': '',
+        'FIREBASE_SERVICE_ACCOUNT_KEY': '',
+        'MOCK_FIRESTORE_LATENCY_MS': str(latency_ms),
+        'MAX_CONCURRENT_HANDSHAKES': '100000',
+        'RETENTION_COMPACT_INTERVAL': '0',
+    })
+    return subprocess.Popen([sys.executable, 'run.py'], cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_for_server(url, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        client = socketio.AsyncClient()
+        try:
+            await client.connect(url, auth={'token': 'dev-token-probe'}, transports=['websocket'])
+            return
+        except Exception:
+            await asyncio.sleep(0.2)
+        finally:
+            await client.disconnect()
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+async def run_load(url, n_clients, n_messages):
+    expected = n_clients * n_messages
+    received = [0] * n_clients
+    latencies = []
+    sent_at = {}
+    done = asyncio.Event()
+    clients = []
+
+    async def make_client(i):
+        client = socketio.AsyncClient()
+        joined = asyncio.Event()
+
+        @client.on('joined_thread')
+        async def on_joined(data):
+            joined.set()
+
+        @client.on('new_message')
+        async def on_message(data):
+            received[i] += 1
+            if data['message'] in sent_at and data['user_id'] == client.get_sid():
+                latencies.append(time.perf_counter() - sent_at.pop(data['message']))
+            if sum(received) >= expected * n_clients:
+                done.set()
+
+        await client.connect(url, auth={'token': f'dev-token-bench{i}'}, transports=['websocket'])
+        await client.emit('join_thread', {'room': 'general'})
+        await asyncio.wait_for(joined.wait(), timeout=30)
+        clients.append(client)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(make_client(i) for i in range(n_clients)))
+    connect_time = time.perf_counter() - start
+
+    async def sender(index, client):
+        for j in range(n_messages):
+            text = f'bench-{index}-{j}'
+            sent_at[text] = time.perf_counter()
+            await client.emit('send_message', {'message': text})
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(i, c) for i, c in enumerate(clients)))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=120)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*(c.disconnect() for c in clients))
+    return {
+        'connect_s': connect_time,
+        'elapsed_s': elapsed,
+        'delivered': sum(received),
+        'expected': expected * n_clients,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else float('nan'),
+        'p95_ms': statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--modes', default='eventlet,asgi')
+    args = parser.parse_args()
+
+    print(f"clients={args.clients} messages/client={args.messages} datastore latency={args.latency_ms}ms")
+    print(f"{'mode':<10}{'connect s':>11}{'send s':>9}{'msg/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'delivered':>14}")
+    for mode in args.modes.split(','):
+        server = start_server(mode, args.port, args.latency_ms)
+        url = f'http://127.0.0.1:{args.port}'
+        try:
+            asyncio.run(wait_for_server(url))
+            r = asyncio.run(run_load(url, args.clients, args.messages))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        print(f"{mode:<10}{r['connect_s']:>11.2f}{r['elapsed_s']:>9.2f}{r['delivered'] / r['elapsed_s']:>10.0f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['delivered']:>8}/{r['expected']}")
+
+
+if __name__ == '__main__':
+    main()
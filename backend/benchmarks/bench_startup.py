@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Startup profile: import-time breakdown and time to first accepted socket
+
+Imports the server module in a fresh interpreter with -X importtime and
+groups self time by top-level package, then starts run.py and measures
+from process spawn until a Socket.IO client is accepted. Also reports
+the Firebase SDK import that is now deferred until first use.
+
+    python benchmarks/bench_startup.py [--mode flask|asgi] [--firebase 0|1] [--top 12] [--runs 3]
+
+Requires aiohttp for the benchmark client (pip install aiohttp).
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import socketio
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+MODES = {
+    'flask': {'SERVER_MODE': 'flask', 'SOCKETIO_ASYNC_MODE': 'eventlet', 'module': 'app'},
+    'asgi': {'SERVER_MODE': 'asgi', 'module': 'asgi_app'},
+}
+
+
+def server_env(mode, firebase, port=None):
+    env = dict(os.environ, **{k: v for k, v in MODES[mode].items() if k != 'module'})
+    env.update({
+        'HOST': '127.0.0.1',
+        'DEV_MODE': '0',
+        'USE_FIREBASE': firebase,
+        'RETENTION_COMPACT_INTERVAL': '0',
+    })
+    if port:
+        env['PORT'] = str(port)
+    return env
+
+
+def import_profile(statement, env):
+    """(wall seconds, {top-level package: self seconds}) for one import in a fresh interpreter"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=BACKEND_DIR,
+                            env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        top = name.strip().split('.')[0]
+        packages[top] = packages.get(top, 0) + int(self_us) / 1e6
+    return wall, packages
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def first_accept(url, timeout=30):
+    """Poll until a client is accepted"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        client = socketio.AsyncClient(reconnection=False)
+        try:
+            await client.connect(url, auth={'token': 'dev-token-probe'}, transports=['websocket'],
+                                 wait_timeout=5)
+            return
+        except Exception:
+            await asyncio.sleep(0.01)
+        finally:
+            await client.disconnect()
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def time_to_first_socket(mode, firebase):
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, 'run.py'], cwd=BACKEND_DIR, env=server_env(mode, firebase, port),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(first_accept(f'http://127.0.0.1:{port}'))
+        return time.perf_counter() - start
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=MODES, default='flask')
+    parser.add_argument('--firebase', choices=('0', '1'), default='1')
+    parser.add_argument('--top', type=int, default=12)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    env = server_env(args.mode, args.firebase)
+    module = MODES[args.mode]['module']
+    wall, packages = import_profile(f'import {module}', env)
+    print(f"import {module} (USE_FIREBASE={args.firebase}): {wall * 1000:.0f} ms wall, "
+          f"{sum(packages.values()) * 1000:.0f} ms in imports")
+    print(f"{'package':<28}{'self ms':>10}")
+    for name, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<28}{seconds * 1000:>10.1f}")
+
+    _, deferred = import_profile('import firebase_admin.firestore, firebase_admin.auth', env)
+    print(f"\nDeferred Firebase SDK import (first use only): {sum(deferred.values()) * 1000:.0f} ms")
+
+    samples = [time_to_first_socket(args.mode, args.firebase) for _ in range(args.runs)]
+    print(f"\nTime to first accepted socket ({args.mode}): median {statistics.median(samples) * 1000:.0f} ms, "
+          f"min {min(samples) * 1000:.0f} ms over {args.runs} runs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Timer wheel benchmark: schedule/cancel cost and CPU per tick vs active timers
+
+For each size, schedules that many timers on a simulated clock and
+measures schedule and cancel cost, the CPU spent per 10 ms tick while
+the timers are pending (it should stay flat as the count grows), and
+the cost per fired timer. A heapq scheduler is timed as a baseline.
+
+    python benchmarks/bench_timer_wheel.py [sizes...]     # default 100000 1000000 2000000
+"""
+
+import gc
+import heapq
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from timer_wheel import TimerWheel
+
+TICK = 0.01
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def noop(keys):
+    pass
+
+
+def bench_wheel(size):
+    clock = FakeClock()
+    wheel = TimerWheel(tick=TICK, clock=clock)
+    # Pending for the whole run: 1-2 hours out, like presence and DM inactivity timeouts
+    delays = [random.uniform(3600, 7200) for _ in range(size)]
+
+    start = time.perf_counter()
+    timers = [wheel.schedule(delay, noop, i) for i, delay in enumerate(delays)]
+    schedule_ns = (time.perf_counter() - start) / size * 1e9
+
+    # 10 simulated seconds of ticks with every timer still pending
+    ticks = 1000
+    start = time.process_time()
+    for _ in range(ticks):
+        clock.now += TICK
+        wheel.run()
+    tick_us = (time.process_time() - start) / ticks * 1e6
+
+    cancel = random.sample(timers, size // 10)
+    start = time.perf_counter()
+    for timer in cancel:
+        timer.cancel()
+    cancel_ns = (time.perf_counter() - start) / len(cancel) * 1e9
+
+    # Typing-TTL style churn: short timers that all fire within 5 seconds
+    fired = min(size, 200000)
+    for i in range(fired):
+        wheel.schedule(random.uniform(0.01, 5), noop, i)
+    start = time.process_time()
+    for _ in range(510):
+        clock.now += TICK
+        wheel.run()
+    fire_ns = (time.process_time() - start) / fired * 1e9
+    return schedule_ns, cancel_ns, tick_us, fire_ns
+
+
+def bench_heap(size):
+    """heapq with lazy cancellation: O(log n) schedule, pop due entries per tick"""
+    heap = []
+    delays = [random.uniform(3600, 7200) for _ in range(size)]
+    start = time.perf_counter()
+    for i, delay in enumerate(delays):
+        heapq.heappush(heap, (delay, i))
+    return (time.perf_counter() - start) / size * 1e9
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000, 2000000]
+    random.seed(1)
+    print(f"{'active timers':>14}{'schedule ns':>13}{'cancel ns':>11}{'us/tick':>9}{'ns/fired':>10}"
+          f"{'heapq push ns':>15}")
+    for size in sizes:
+        gc.collect()
+        gc.disable()
+        schedule_ns, cancel_ns, tick_us, fire_ns = bench_wheel(size)
+        heap_ns = bench_heap(size)
+        gc.enable()
+        print(f"{size:>14}{schedule_ns:>13.0f}{cancel_ns:>11.0f}{tick_us:>9.1f}{fire_ns:>10.0f}{heap_ns:>15.0f}")
+
+
+if __name__ == '__main__':
+    main()
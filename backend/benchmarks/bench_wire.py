@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Wire format benchmark: bytes per event and encode CPU for bulk payloads
+
+Compares json / compact / msgpack for the payloads the server sends in
+bulk, raw and after deflate (what permessage-deflate would put on the wire).
+
+    python benchmarks/bench_wire.py [iterations]
+"""
+
+import json
+import sys
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from wire import encode_rows, msgpack
+
+
+def history(n=50):
+    now = time.time()
+    return [{
+        'id': str(uuid.uuid4()),
+        'username': f'user-{i % 7}',
+        'message': f'message body number {i} with some ordinary chat text',
+        'room': 'general',
+        'timestamp': now + i,
+        'user_id': f'sid{i % 7:017d}',
+        'firebase_uid': f'dev-user-user-{i % 7}',
+        'server_timestamp': now + i + 0.01,
+        'firestore_id': f'doc_{i}',
+        'created_at': now + i
+    } for i in range(n)]
+
+
+def online_users(n=100):
+    return [{
+        'user_id': f'sid{i:017d}',
+        'username': f'user-{i}',
+        'firebase_uid': f'dev-user-user-{i}',
+        'last_seen': time.time()
+    } for i in range(n)]
+
+
+def dm_list(n=20):
+    return [{
+        'dm_room_id': f'dm_sid{0:017d}_sid{i:017d}',
+        'other_user': {
+            'user_id': f'sid{i:017d}',
+            'username': f'user-{i}',
+            'firebase_uid': f'dev-user-user-{i}',
+            'online': i % 2 == 0
+        },
+        'last_message_at': time.time(),
+        'unread_count': i
+    } for i in range(n)]
+
+
+def serialize(payload):
+    """Bytes the Socket.IO packet carries for this payload"""
+    if isinstance(payload, bytes):
+        return payload
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    formats = ['json', 'compact'] + (['msgpack'] if msgpack else [])
+    payloads = {
+        'joined_thread (50 msgs)': history(),
+        'online_users (100)': online_users(),
+        'dm_list (20)': dm_list(),
+    }
+
+    print(f"{'payload':<26}{'format':<9}{'bytes':>8}{'deflated':>10}{'encode us':>11}")
+    for name, rows in payloads.items():
+        for wire in formats:
+            data = serialize(encode_rows(rows, wire))
+            start = time.perf_counter()
+            for _ in range(iterations):
+                serialize(encode_rows(rows, wire))
+            cpu_us = (time.perf_counter() - start) / iterations * 1e6
+            deflated = len(zlib.compress(data, 6)) - 6  # strip zlib header/checksum
+            print(f"{name:<26}{wire:<9}{len(data):>8}{deflated:>10}{cpu_us:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
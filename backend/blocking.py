@@ -0,0 +1,18 @@
+"""
+Bounded Thread Pool for Blocking SDK Calls in Async Mode
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCKING_POOL_SIZE = int(os.getenv('BLOCKING_POOL_SIZE', '16'))
+
+executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix='blocking')
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the bounded pool without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,465 @@
+"""
+Shared Chat State for Both Servers
+
+Sessions, rooms, DM rooms, typing indicators, room sequencing and the
+event payloads built from them. app.py (Flask-SocketIO) and asgi_app.py
+(asyncio) each hold one ChatState and only add their own I/O around it:
+datastore calls, forwarding to other shards and Socket.IO emits. Nothing
+in here blocks, so it is safe to call from either event loop.
+"""
+
+import os
+import time
+
+from records import Session, Message
+from retention import RetentionConfig, RoomHistory
+from wire import FIELD_CODES, encode_rows
+from event_log import EventLog
+from membership import MembershipAggregator
+from sharding import RoomSequencer, ShardRouter
+from dedup import DedupCache, valid_client_msg_id
+from timer_wheel import TimerWheel
+
+DEFAULT_ROOM = "general"
+
+# Messages per room returned on join
+HISTORY_LIMIT = 50
+
+# Messages per DM included in the bootstrap event
+BOOTSTRAP_DM_HISTORY = int(os.getenv('BOOTSTRAP_DM_HISTORY', '20'))
+
+# Placeholder for lookups of sessions that are no longer connected
+UNKNOWN_SESSION = Session('Unknown', None, 0)
+
+
+class ChatState:
+    """In-memory chat state shared by the Flask and ASGI servers.
+
+    broadcast(event, data, room) is used by timer handlers, which run
+    outside any request; everything else returns data for the server to emit.
+    """
+
+    def __init__(self, retention, use_firebase=True, event_log=None, membership=None, shards=None,
+                 dedup=None, timers=None, typing_ttl=5.0, broadcast=None, dev_mode=False):
+        self.retention = retention
+        self.use_firebase = use_firebase
+        self.event_log = event_log
+        self.membership = membership or MembershipAggregator()
+        self.shards = shards  # None runs a single shard
+        self.dedup = dedup or DedupCache()
+        self.timers = timers or TimerWheel()
+        self.typing_ttl = typing_ttl
+        self.broadcast = broadcast
+        self.dev_mode = dev_mode
+
+        self.messages = RoomHistory.from_env(retention)  # Message records per room (local mode)
+        self.known_rooms = set()  # Rooms with persisted history, visited by compaction
+        self.connected_users = {}  # sid -> Session
+        self.typing_users = set()
+        self.typing_timers = {}  # sid -> Timer
+        self.dm_rooms = {}
+        self.sequencer = RoomSequencer()
+        self.pending_handoffs = set()  # Moved rooms still held here until their new owner has them
+
+    @classmethod
+    def from_env(cls, use_firebase, broadcast, dev_mode=False):
+        state = cls(
+            retention=RetentionConfig.from_env(),
+            use_firebase=use_firebase,
+            # Durable local mode: messages and DM rooms are appended to a segmented log
+            # under EVENT_LOG_DIR and replayed into memory on startup
+            event_log=None if use_firebase else EventLog.from_env(),
+            membership=MembershipAggregator.from_env(),
+            shards=ShardRouter.from_env(),
+            dedup=DedupCache.from_env(),
+            timers=TimerWheel.from_env(),
+            typing_ttl=float(os.getenv('TYPING_TTL', '5')),
+            broadcast=broadcast,
+            dev_mode=dev_mode
+        )
+        if state.event_log:
+            restored = state.event_log.restore(state.messages, state.dm_rooms)
+            print(f"Restored {restored} messages and {len(state.dm_rooms)} DM rooms from {state.event_log.directory}")
+        if state.shards:
+            print(f"Shard {state.shards.shard_id} of {len(state.shards.peers)}")
+        return state
+
+    def owns(self, room):
+        return self.shards is None or self.shards.owns(room)
+
+    def stats(self):
+        """Health counters common to both servers"""
+        return {
+            'connected_users': len(self.connected_users),
+            'history': {'rooms': len(self.messages.rooms()), 'messages': len(self.messages),
+                        'evicted_rooms': self.messages.evicted_rooms},
+            'membership': self.membership.stats(),
+            'shards': self.shards.stats() if self.shards else None,
+            'dedup': self.dedup.stats(),
+            'timers': self.timers.stats()
+        }
+
+    # Sessions
+    def guest_identity(self, sid, auth):
+        """(username, user_id) for a dev token or an anonymous connection"""
+        token = auth.get('token') or ''
+        if token.startswith('dev-token-'):
+            username = token.replace('dev-token-', '')
+            if self.dev_mode:
+                print(f"Dev token authenticated: {username}")
+            return username, f'dev-user-{username}'
+        username = auth.get('username', f'User_{sid[:8]}')
+        if self.dev_mode:
+            print(f"👤 Anonymous user: {username}")
+        return username, f'anonymous-{sid}'
+
+    @staticmethod
+    def firebase_identity(sid, firebase_user):
+        """(username, user_id, profile) for a verified Firebase user"""
+        username = firebase_user.get('name') or firebase_user.get('email', f'User_{sid[:8]}')
+        user_id = firebase_user['uid']
+        profile = {
+            'uid': user_id,
+            'email': firebase_user.get('email'),
+            'name': firebase_user.get('name'),
+            'picture': firebase_user.get('picture'),
+            'last_seen': time.time()
+        }
+        return username, user_id, profile
+
+    def connect(self, sid, username, user_id, firebase_uid, wire):
+        """Register a session, returns the payload of its connected event"""
+        self.connected_users[sid] = Session(
+            username=username,
+            user_id=user_id,
+            joined_at=time.time(),
+            room=None,
+            firebase_uid=firebase_uid,
+            wire=wire
+        )
+        connected = {
+            'message': 'Connected successfully',
+            'user_id': sid,
+            'username': username,
+            'firebase_uid': user_id,
+            'wire': wire
+        }
+        if wire != 'json':
+            connected['field_codes'] = FIELD_CODES
+        return connected
+
+    def disconnect(self, sid, announce=True):
+        """Forget a session, queueing its leave for the room; returns the session or None"""
+        session = self.connected_users.get(sid)
+        if session is None:
+            return None
+        was_typing = sid in self.typing_users
+        self.set_typing(sid, False)
+        if session.room and announce:
+            self.membership.left(session.room, sid, session.username, typing=was_typing)
+        del self.connected_users[sid]
+        return session
+
+    def wire_for(self, sid):
+        return self.connected_users.get(sid, UNKNOWN_SESSION).wire
+
+    # Rooms
+    def enter_room(self, sid, room):
+        """Move a session into a chat room, returns the room it has to leave (or None)"""
+        session = self.connected_users[sid]
+        old_room = session.room
+        if old_room == room:
+            old_room = None
+        elif old_room:
+            self.membership.left(old_room, sid, session.username, typing=sid in self.typing_users)
+        session.room = room
+        self.known_rooms.add(room)
+        return old_room
+
+    def announce_join(self, sid, room):
+        """Notify the room with the next membership_delta"""
+        session = self.connected_users[sid]
+        self.membership.joined(room, sid, session.username)
+        print(f"User {session.username} joined room {room}")
+
+    def room_users(self, room):
+        return [
+            {'username': user.username, 'user_id': uid}
+            for uid, user in self.connected_users.items()
+            if user.room == room
+        ]
+
+    def room_info(self, room, total_messages):
+        room_users = self.room_users(room)
+        return {
+            'room': room,
+            'users': room_users,
+            'member_count': len(room_users),
+            'total_messages': total_messages
+        }
+
+    def membership_frames(self):
+        """(room, membership_delta) pairs collected since the last window"""
+        return self.membership.flush(list(self.connected_users.values()), self.room_typing_users)
+
+    def compaction_rooms(self):
+        """Rooms this shard owns whose persisted history compaction visits"""
+        rooms = self.known_rooms | set(self.dm_rooms) | {DEFAULT_ROOM}
+        return {room for room in rooms if self.owns(room)}
+
+    def compact_local(self):
+        """Apply retention to the in-memory history, returns messages removed"""
+        return self.messages.compact()
+
+    def compact_event_log(self):
+        """Apply retention to the event log; blocking file I/O, run it off the event loop"""
+        if self.event_log:
+            self.event_log.compact(self.retention)
+
+    # Typing
+    def room_typing_users(self, room):
+        """Usernames currently typing in a room"""
+        return [self.connected_users[uid].username
+                for uid in self.typing_users
+                if uid in self.connected_users and self.connected_users[uid].room == room]
+
+    def set_typing(self, sid, typing):
+        """Track a typing indicator and (re)arm its TYPING_TTL expiry"""
+        timer = self.typing_timers.pop(sid, None)
+        if timer:
+            timer.cancel()
+        if typing:
+            self.typing_users.add(sid)
+            self.typing_timers[sid] = self.timers.schedule(self.typing_ttl, self.expire_typing, sid)
+        else:
+            self.typing_users.discard(sid)
+
+    def expire_typing(self, sids):
+        """Clear stale typing indicators, one typing_update per affected room"""
+        rooms = set()
+        for sid in sids:
+            timer = self.typing_timers.get(sid)
+            if timer is not None and timer.active:
+                continue  # Refreshed after this batch came due
+            self.typing_timers.pop(sid, None)
+            session = self.connected_users.get(sid)
+            if sid in self.typing_users and session and session.room:
+                rooms.add(session.room)
+            self.typing_users.discard(sid)
+        for room in rooms:
+            self.broadcast('typing_update', {'typing_users': self.room_typing_users(room)}, room)
+
+    # Messages
+    def new_message(self, sid, data):
+        """Build a send_message payload for the session's room, returns (message, error)"""
+        session = self.connected_users[sid]
+        if not session.room:
+            return None, 'Not in any room'
+
+        message_text = data.get('message', '').strip()
+        if not message_text:
+            return None, 'Message cannot be empty'
+
+        # Idempotency key, reused by the client when it retries this send
+        client_msg_id = data.get('client_msg_id')
+        if client_msg_id is not None and not valid_client_msg_id(client_msg_id):
+            return None, 'Invalid client_msg_id'
+
+        message = Message(
+            username=session.username,
+            message=message_text,
+            room=session.room,
+            timestamp=time.time(),
+            user_id=sid,
+            firebase_uid=session.firebase_uid
+        ).to_dict()
+        if client_msg_id:
+            message['client_msg_id'] = client_msg_id
+        message['sender'] = session.user_id
+        return message, None
+
+    def recent_messages(self, room, limit=HISTORY_LIMIT):
+        """Recent messages of a room from the in-memory history"""
+        return [msg.to_dict() for msg in self.messages.recent(room, limit)]
+
+    @staticmethod
+    def last_seq(recent):
+        """Sequence number of the newest message in a history slice"""
+        return (recent[-1].get('seq') or 0) if recent else 0
+
+    def claim_send(self, message):
+        """Claim a message's client_msg_id on the owning shard.
+
+        Returns (sender, ack); ack['duplicate'] is set when the id was
+        already sent, and the message must not be stored again.
+        """
+        message.pop('hops', None)
+        sender = message.pop('sender', message['user_id'])
+        client_msg_id = message.get('client_msg_id')
+        ack = {'id': message['id'], 'seq': None, 'client_msg_id': client_msg_id, 'duplicate': False}
+        if client_msg_id:
+            previous = self.dedup.claim(sender, client_msg_id, ack)
+            if previous is not None:
+                if self.dev_mode:
+                    print(f"Duplicate send {client_msg_id} from {message['username']} acknowledged")
+                return sender, {**previous, 'duplicate': True}
+        return sender, ack
+
+    def assign_seq(self, message, ack):
+        message['seq'] = ack['seq'] = self.sequencer.next(message['room'])
+
+    def release_send(self, sender, ack):
+        """Drop a claim whose write failed so the client's retry goes through"""
+        if ack['client_msg_id']:
+            self.dedup.forget(sender, ack['client_msg_id'])
+
+    def store_message(self, message):
+        """Keep a message in memory, made durable by the event log when enabled"""
+        self.messages.append(Message.from_dict(message))
+        if self.event_log:
+            self.event_log.append_message(message)
+
+    # Direct Messages
+    def user_dm_rooms(self, user_id):
+        """DM room ids the user participates in"""
+        return [dm_room_id for dm_room_id, dm_info in self.dm_rooms.items() if user_id in dm_info['participants']]
+
+    def create_dm(self, sid, target_user_id):
+        """Record a DM room between two sessions, returns its id"""
+        first, second = sorted([sid, target_user_id])
+        dm_room_id = f"dm_{first}_{second}"
+        self.dm_rooms[dm_room_id] = {
+            'participants': [sid, target_user_id],
+            'created_at': time.time(),
+            'last_message_at': time.time()
+        }
+        return dm_room_id
+
+    def register_dm(self, payload):
+        """Store a DM room's info (owner side)"""
+        self.dm_rooms[payload['dm_room_id']] = payload['info']
+        if self.event_log:
+            self.event_log.append_dm(payload['dm_room_id'], payload['info'])
+        return payload['info']
+
+    def dm_info(self, payload):
+        return self.dm_rooms.get(payload['dm_room_id'])
+
+    def dm_known_elsewhere(self, dm_room_id):
+        """Whether a DM room may have been created through another shard"""
+        return dm_room_id not in self.dm_rooms and self.shards is not None and not self.owns(dm_room_id)
+
+    def dm_join_error(self, sid, dm_room_id):
+        if dm_room_id not in self.dm_rooms:
+            return 'DM room not found'
+        if sid not in self.dm_rooms[dm_room_id]['participants']:
+            return 'You are not a participant in this DM'
+        return None
+
+    def participant(self, user_id):
+        session = self.connected_users.get(user_id, UNKNOWN_SESSION)
+        return {'user_id': user_id, 'username': session.username, 'firebase_uid': session.firebase_uid}
+
+    def unread_counts(self, dm_ids, stats=None):
+        """Messages per DM (simplified - in real app, track read status)"""
+        if stats is not None:
+            return {dm_room_id: stats[dm_room_id].get('total_messages', 0) for dm_room_id in dm_ids}
+        return {dm_room_id: self.messages.count(dm_room_id) for dm_room_id in dm_ids}
+
+    def dm_summaries(self, sid, unread_counts):
+        """DM list entries for a user, most recently active first"""
+        user_dms = []
+        for dm_room_id, unread_count in unread_counts.items():
+            dm_info = self.dm_rooms[dm_room_id]
+            # Get the other participant
+            other_participant_id = [pid for pid in dm_info['participants'] if pid != sid][0]
+            other_user = self.connected_users.get(other_participant_id, UNKNOWN_SESSION)
+
+            user_dms.append({
+                'dm_room_id': dm_room_id,
+                'other_user': {
+                    'user_id': other_participant_id,
+                    'username': other_user.username,
+                    'firebase_uid': other_user.firebase_uid,
+                    'online': other_participant_id in self.connected_users
+                },
+                'last_message_at': dm_info['last_message_at'],
+                'unread_count': unread_count
+            })
+
+        user_dms.sort(key=lambda x: x['last_message_at'], reverse=True)
+        return user_dms
+
+    def online_user_list(self, sid):
+        """Other connected users, sorted by username"""
+        online_users = [
+            {
+                'user_id': uid,
+                'username': session.username,
+                'firebase_uid': session.firebase_uid,
+                'last_seen': session.joined_at
+            }
+            for uid, session in self.connected_users.items()
+            if uid != sid
+        ]
+        online_users.sort(key=lambda x: x['username'])
+        return online_users
+
+    # Bootstrap
+    def history_limits(self, room, dm_ids):
+        """History to load on bootstrap as ({room: limit}, the subset this shard owns)"""
+        limits = {room: HISTORY_LIMIT, **{dm_room_id: BOOTSTRAP_DM_HISTORY for dm_room_id in dm_ids}}
+        return limits, {r: limit for r, limit in limits.items() if self.owns(r)}
+
+    def bootstrap_event(self, sid, room, history, dm_ids, unread_counts):
+        wire = self.wire_for(sid)
+        return {
+            'room': room,
+            'recent_messages': encode_rows(history[room], wire),
+            'dms': encode_rows(self.dm_summaries(sid, unread_counts), wire),
+            'dm_messages': {dm_room_id: encode_rows(history[dm_room_id], wire) for dm_room_id in dm_ids},
+            'online_users': encode_rows(self.online_user_list(sid), wire)
+        }
+
+    # Shard Hand-off
+    def handoff_room(self, payload):
+        """Take over a room's history and sequence from its previous owner"""
+        room = payload['room']
+        if not self.use_firebase:  # Otherwise history lives in Firestore already
+            # A retried handoff may have landed already
+            held = {msg.id for msg in self.messages.recent(room, self.messages.max_room_messages)}
+            for data in payload.get('messages', []):
+                if data['id'] not in held:
+                    self.store_message(data)
+        if payload.get('dm'):
+            self.register_dm({'dm_room_id': room, 'info': payload['dm']})
+        self.sequencer.restore(room, payload.get('seq'))
+        self.known_rooms.add(room)
+        return len(payload.get('messages', []))
+
+    def rebalance(self, peers):
+        """Apply a new peer list; returns (new owner, handoff payload) for each room that moved away.
+
+        Rooms whose earlier handoff failed are included again. A room's
+        history and sequence stay here until handed_off() is called for it.
+        """
+        rooms = set(self.messages.rooms()) | set(self.sequencer.rooms()) | set(self.dm_rooms) | self.known_rooms
+        moved = self.shards.update_peers(peers, rooms)
+        for room in self.pending_handoffs:
+            if not self.owns(room):
+                moved.setdefault(room, self.shards.owner(room))
+        self.pending_handoffs = set(moved)
+        handoffs = []
+        for room, owner in moved.items():
+            history = [msg.to_dict() for msg in self.messages.recent(room, self.messages.max_room_messages)]
+            handoffs.append((owner, {'room': room, 'messages': history, 'seq': self.sequencer.current(room),
+                                     'dm': self.dm_rooms.get(room)}))
+        return handoffs
+
+    def handed_off(self, room):
+        """Forget a moved room's history and sequence once its new owner has them"""
+        self.messages.drop(room)
+        self.sequencer.pop(room)
+        self.known_rooms.discard(room)
+        self.pending_handoffs.discard(room)
+        self.shards.handed_off()
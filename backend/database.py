@@ -6,16 +6,28 @@ import time
 import uuid
 from datetime import datetime
 from firebase_config import firebase_config
+from queries import (RECENT_MESSAGES, EXPIRED_MESSAGES, OVERFLOW_MESSAGES, ROOM_MESSAGE_COUNT,
+                     ROOM_ACTIVE_USERS, ROOM_RECENT_SENDERS, PUBLIC_ROOMS)
 
 class DatabaseService:
     """Service layer for database operations"""
     
-    def __init__(self):
-        self.db = firebase_config.get_firestore()
+    def __init__(self, raise_errors=False):
+        self._db = None
+        # Guarded callers (db_executor) need errors raised, not replaced by a fallback,
+        # so the circuit breaker counts them and the last-good cache skips them
+        self.raise_errors = raise_errors
+    
+    @property
+    def db(self):
+        """Firestore client, initialized on first use so local mode never loads Firebase"""
+        if self._db is None:
+            self._db = firebase_config.get_firestore()
+        return self._db
     
     # Message Operations
-    def save_message(self, message_data):
-        """Save a message to Firestore"""
+    def save_message(self, message_data, doc_id=None):
+        """Save a message to Firestore, overwriting doc_id when given"""
         try:
             # Create a copy for Firestore (with datetime)
             firestore_data = message_data.copy()
@@ -23,7 +35,11 @@ class DatabaseService:
             firestore_data['server_timestamp'] = time.time()
             
             # Save to Firestore
-            doc_ref = self.db.collection('messages').add(firestore_data)
+            if doc_id:
+                doc_ref = self.db.collection('messages').document(doc_id)
+                doc_ref.set(firestore_data)
+            else:
+                doc_ref = self.db.collection('messages').add(firestore_data)
             
             # Return JSON-serializable data (no datetime objects)
             result_data = message_data.copy()
@@ -37,16 +53,17 @@ class DatabaseService:
             return result_data
             
         except Exception as e:
+            if self.raise_errors:
+                raise
             print(f"ERROR: Error saving message: {e}")
             return message_data
     
-    def get_recent_messages(self, room, limit=50):
-        """Get recent messages for a room"""
+    def get_recent_messages(self, room, limit=50, policy=None):
+        """Get recent messages for a room, skipping any past the retention policy"""
         try:
-            messages_ref = self.db.collection('messages')
-            query = messages_ref.where('room', '==', room)\
-                              .order_by('server_timestamp', direction='DESCENDING')\
-                              .limit(limit)
+            cutoff = policy.cutoff() if policy else None
+            bounds = [('>=', cutoff)] if cutoff is not None else []
+            query = RECENT_MESSAGES.build(self.db, {'room': room}, bounds, limit=limit)
             
             messages = []
             for doc in query.stream():
@@ -69,6 +86,8 @@ class DatabaseService:
             return messages
             
         except Exception as e:
+            if self.raise_errors:
+                raise
             print(f"ERROR: Error retrieving messages: {e}")
             return []
     
@@ -79,9 +98,65 @@ class DatabaseService:
             print(f"🗑️ Message deleted: {message_id}")
             return True
         except Exception as e:
+            if self.raise_errors:
+                raise
             print(f"ERROR: Error deleting message: {e}")
             return False
     
+    def delete_messages(self, docs, archive=False):
+        """Delete message snapshots in a single batch, optionally archiving them first"""
+        if not docs:
+            return 0
+        try:
+            messages_ref = self.db.collection('messages')
+            archive_ref = self.db.collection('messages_archive')
+            batch = self.db.batch()
+            for doc in docs:
+                if archive:
+                    batch.set(archive_ref.document(doc.id), doc.to_dict())
+                batch.delete(messages_ref.document(doc.id))
+            batch.commit()
+            return len(docs)
+        except Exception as e:
+            if self.raise_errors:
+                raise
+            print(f"ERROR: Error deleting message batch: {e}")
+            return 0
+    
+    def compact_room(self, room, policy, batch_size=200, archive=False):
+        """Remove messages outside the room's retention policy in batches"""
+        removed = 0
+        try:
+            # Age: everything older than the cutoff
+            cutoff = policy.cutoff()
+            
+            # Count: everything older than the oldest of the newest max_messages. Found
+            # once, as Firestore bills every document an offset skips
+            if policy.max_messages is not None:
+                kept = list(OVERFLOW_MESSAGES.build(self.db, {'room': room}, limit=1,
+                                                    offset=policy.max_messages - 1).stream())
+                if kept:
+                    boundary = kept[0].to_dict()['server_timestamp']
+                    cutoff = boundary if cutoff is None else max(cutoff, boundary)
+            
+            while cutoff is not None:
+                docs = list(EXPIRED_MESSAGES.build(self.db, {'room': room}, [('<', cutoff)],
+                                                   limit=batch_size).stream())
+                deleted = self.delete_messages(docs, archive=archive)
+                removed += deleted
+                if deleted < batch_size:
+                    break
+            
+            if removed:
+                print(f"🗑️ Compacted {removed} messages in room '{room}'")
+            return removed
+            
+        except Exception as e:
+            if self.raise_errors:
+                raise
+            print(f"ERROR: Error compacting room {room}: {e}")
+            return removed
+    
     # User Operations
     def save_user_profile(self, user_data):
         """Save or update user profile"""
@@ -113,6 +188,8 @@ class DatabaseService:
             return user_data
             
         except Exception as e:
+            if self.raise_errors:
+                raise
             print(f"ERROR: Error saving user profile: {e}")
             return user_data
     
@@ -128,6 +205,8 @@ class DatabaseService:
                 return None
                 
         except Exception as e:
+            if self.raise_errors:
+                raise
             print(f"ERROR: Error retrieving user profile: {e}")
             return None
     
@@ -138,9 +217,7 @@ class DatabaseService:
             # For now, return users who have sent messages recently
             cutoff_time = time.time() - 300  # 5 minutes ago
             
-            messages_ref = self.db.collection('messages')
-            query = messages_ref.where('room', '==', room)\
-                              .where('server_timestamp', '>', cutoff_time)
+            query = ROOM_RECENT_SENDERS.build(self.db, {'room': room}, [('>', cutoff_time)])
             
             users = set()
             for doc in query.stream():
@@ -150,6 +227,8 @@ class DatabaseService:
             return list(users)
             
         except Exception as e:
+            if self.raise_errors:
+                raise
             print(f"ERROR: Error getting online users: {e}")
             return []
     
@@ -167,6 +246,8 @@ class DatabaseService:
             return room_data
             
         except Exception as e:
+            if self.raise_errors:
+                raise
             print(f"ERROR: Error creating room: {e}")
             return room_data
     
@@ -174,10 +255,8 @@ class DatabaseService:
         """Get rooms that a user has access to"""
         try:
             # For now, return all public rooms + rooms user has joined
-            rooms_ref = self.db.collection('rooms')
-            
             # Get public rooms
-            public_rooms = rooms_ref.where('is_public', '==', True).stream()
+            public_rooms = PUBLIC_ROOMS.build(self.db, {'is_public': True}).stream()
             
             rooms = []
             for doc in public_rooms:
@@ -198,23 +277,26 @@ class DatabaseService:
             return rooms
             
         except Exception as e:
+            if self.raise_errors:
+                raise
             print(f"ERROR: Error getting user rooms: {e}")
             return [{'room_id': 'general', 'name': 'general', 'is_public': True}]
     
     # Analytics and Stats
-    def get_room_stats(self, room):
-        """Get statistics for a room"""
+    def get_room_stats(self, room, policy=None):
+        """Get statistics for a room, counting only messages the retention policy keeps"""
         try:
-            messages_ref = self.db.collection('messages')
-            
-            # Count total messages
-            total_messages = len(list(messages_ref.where('room', '==', room).stream()))
+            # Count retained messages (expired ones may still await compaction)
+            cutoff = policy.cutoff() if policy else None
+            bounds = [('>=', cutoff)] if cutoff is not None else []
+            query = ROOM_MESSAGE_COUNT.build(self.db, {'room': room}, bounds)
+            total_messages = len(list(query.stream()))
+            if policy and policy.max_messages is not None:
+                total_messages = min(total_messages, policy.max_messages)
             
             # Count unique users (last 24 hours)
             day_ago = time.time() - 86400
-            recent_messages = messages_ref.where('room', '==', room)\
-                                        .where('server_timestamp', '>', day_ago)\
-                                        .stream()
+            recent_messages = ROOM_ACTIVE_USERS.build(self.db, {'room': room}, [('>', day_ago)]).stream()
             
             unique_users = set()
             for doc in recent_messages:
@@ -228,6 +310,8 @@ class DatabaseService:
             }
             
         except Exception as e:
+            if self.raise_errors:
+                raise
             print(f"ERROR: Error getting room stats: {e}")
             return {'total_messages': 0, 'active_users_24h': 0, 'room': room}
 
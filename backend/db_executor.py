@@ -0,0 +1,404 @@
+"""
+Datastore Executor - bounded offload, timeouts and circuit breaking for DatabaseService
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import blocking
+
+_DEFAULT = object()
+
+
+class DatastoreTimeout(Exception):
+    """A datastore call exceeded its deadline"""
+
+
+class DatastoreUnavailable(Exception):
+    """A datastore call with no fallback failed or was rejected by the breaker"""
+
+
+# fallback for calls that must not report success unless they ran, e.g. writes
+NO_FALLBACK = object()
+
+
+def _on_pool(func, done):
+    """func calling done() once it has finished on the pool, even if its caller timed out"""
+    if done is None:
+        return func
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            done()
+    return run
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, lets one trial call through after reset_timeout"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        """Whether a call may proceed right now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_in_flight:
+                    print(f"WARNING: Datastore circuit opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class DatastoreExecutor:
+    """Runs blocking datastore calls on a bounded pool with per-call timeouts.
+
+    mode follows the Socket.IO async mode: 'eventlet' waits on eventlet's
+    native thread pool, 'threading' on blocking.executor and 'asyncio'
+    awaits blocking.executor from the event loop. When a call times out,
+    raises or the breaker is open the last good result for its cache key
+    (or the caller's fallback) is returned instead, and with
+    fallback=NO_FALLBACK DatastoreUnavailable is raised. Only results of
+    calls that returned normally are cached, and both timeouts and errors
+    count towards opening the breaker, so the functions run here must raise
+    on failure rather than return a fallback of their own.
+
+    done, when given, is called once the call has finished on the pool (or
+    right away when it never ran), however long the caller waited for it.
+    """
+
+    def __init__(self, mode, pool_size, timeout, breaker, cache_size=1024):
+        self.mode = mode
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.breaker = breaker
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._counters = {'calls': 0, 'timeouts': 0, 'errors': 0, 'rejected': 0, 'degraded': 0}
+
+        if mode == 'eventlet':
+            from eventlet import tpool
+            tpool.set_num_threads(pool_size)
+
+    @classmethod
+    def from_env(cls, mode):
+        return cls(
+            mode=mode,
+            pool_size=blocking.BLOCKING_POOL_SIZE,
+            timeout=float(os.getenv('DATASTORE_TIMEOUT', '5')),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv('DATASTORE_BREAKER_THRESHOLD', '5')),
+                reset_timeout=float(os.getenv('DATASTORE_BREAKER_RESET', '30'))
+            )
+        )
+
+    # Bookkeeping
+    def _enter(self):
+        with self._lock:
+            self._counters['calls'] += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    def _leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _remember(self, cache_key, result):
+        if cache_key is None:
+            return
+        with self._lock:
+            self._cache[cache_key] = result
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _degraded(self, func, cache_key, fallback):
+        self._count('degraded')
+        with self._lock:
+            if cache_key is not None and cache_key in self._cache:
+                return self._cache[cache_key]
+        if fallback is NO_FALLBACK:
+            raise DatastoreUnavailable(f"Datastore call {func.__name__} did not complete")
+        return fallback
+
+    def _failed(self, func, error):
+        if isinstance(error, DatastoreTimeout):
+            self._count('timeouts')
+            print(f"WARNING: Datastore call {func.__name__} timed out after {self.timeout}s")
+        else:
+            self._count('errors')
+            print(f"ERROR: Datastore call {func.__name__} failed: {error}")
+        self.breaker.record_failure()
+
+    # Calls
+    def _wait(self, func, args, kwargs, timeout):
+        if self.mode == 'eventlet':
+            import eventlet
+            from eventlet import tpool
+            with eventlet.Timeout(timeout, DatastoreTimeout()):
+                return tpool.execute(func, *args, **kwargs)
+        future = blocking.executor.submit(func, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            raise DatastoreTimeout()
+
+    def call(self, func, *args, fallback=None, cache_key=None, timeout=_DEFAULT, done=None, **kwargs):
+        """Run func on the pool and wait (eventlet / threading modes)"""
+        if not self.breaker.allow():
+            self._count('rejected')
+            if done:
+                done()
+            return self._degraded(func, cache_key, fallback)
+
+        self._enter()
+        try:
+            result = self._wait(_on_pool(func, done), args, kwargs, self.timeout if timeout is _DEFAULT else timeout)
+        except Exception as e:
+            self._failed(func, e)
+            return self._degraded(func, cache_key, fallback)
+        finally:
+            self._leave()
+
+        self.breaker.record_success()
+        self._remember(cache_key, result)
+        return result
+
+    async def call_async(self, func, *args, fallback=None, cache_key=None, timeout=_DEFAULT, done=None, **kwargs):
+        """Run func on the pool and await it (asyncio mode)"""
+        if not self.breaker.allow():
+            self._count('rejected')
+            if done:
+                done()
+            return self._degraded(func, cache_key, fallback)
+
+        self._enter()
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(blocking.executor, functools.partial(_on_pool(func, done), *args, **kwargs))
+            try:
+                result = await asyncio.wait_for(future, self.timeout if timeout is _DEFAULT else timeout)
+            except asyncio.TimeoutError:
+                raise DatastoreTimeout()
+        except Exception as e:
+            self._failed(func, e)
+            return self._degraded(func, cache_key, fallback)
+        finally:
+            self._leave()
+
+        self.breaker.record_success()
+        self._remember(cache_key, result)
+        return result
+
+    def call_many(self, calls):
+        """Run independent calls concurrently and wait for all (eventlet / threading modes).
+
+        calls is a list of (func, args, kwargs); kwargs may carry fallback,
+        cache_key, timeout and done as for call(). Results come back in order.
+        """
+        if self.mode == 'eventlet':
+            import eventlet
+            pool = eventlet.GreenPool(max(1, len(calls)))
+            return list(pool.starmap(lambda func, args, kwargs: self.call(func, *args, **kwargs), calls))
+
+        # Submit everything before waiting on anything
+        results = [None] * len(calls)
+        submitted = []
+        for i, (func, args, kwargs) in enumerate(calls):
+            kwargs = dict(kwargs)
+            fallback = kwargs.pop('fallback', None)
+            cache_key = kwargs.pop('cache_key', None)
+            timeout = kwargs.pop('timeout', self.timeout)
+            done = kwargs.pop('done', None)
+            if not self.breaker.allow():
+                self._count('rejected')
+                if done:
+                    done()
+                results[i] = self._degraded(func, cache_key, fallback)
+                continue
+            self._enter()
+            future = blocking.executor.submit(_on_pool(func, done), *args, **kwargs)
+            submitted.append((i, func, future, fallback, cache_key, timeout))
+
+        start = time.monotonic()
+        for i, func, future, fallback, cache_key, timeout in submitted:
+            try:
+                remaining = None if timeout is None else max(0, timeout - (time.monotonic() - start))
+                try:
+                    result = future.result(timeout=remaining)
+                except concurrent.futures.TimeoutError:
+                    raise DatastoreTimeout()
+            except Exception as e:
+                self._failed(func, e)
+                results[i] = self._degraded(func, cache_key, fallback)
+                continue
+            finally:
+                self._leave()
+            self.breaker.record_success()
+            self._remember(cache_key, result)
+            results[i] = result
+        return results
+
+    async def call_many_async(self, calls):
+        """Run independent calls concurrently and await all (asyncio mode)"""
+        return await asyncio.gather(*(self.call_async(func, *args, **kwargs) for func, args, kwargs in calls))
+
+    def stats(self):
+        """Pool saturation and breaker state; saturation above 1.0 means calls are queueing"""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'pool_size': self.pool_size,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'saturation': round(self._in_flight / self.pool_size, 2) if self.pool_size else None,
+                'breaker': self.breaker.state,
+                **self._counters
+            }
+
+
+class GuardedDatabaseService:
+    """DatabaseService facade whose calls go through a DatastoreExecutor.
+
+    Methods return plain results in eventlet/threading mode and awaitables
+    in asyncio mode; each declares what to serve while the datastore is
+    slow or unavailable. service should raise on errors
+    (DatabaseService(raise_errors=True)) so the executor can see them.
+    """
+
+    def __init__(self, service, executor):
+        self._service = service
+        self.executor = executor
+        self._call = executor.call_async if executor.mode == 'asyncio' else executor.call
+        self._writes = None
+
+    def track_writes(self, admission):
+        """Keep writes pending in admission until the pool has finished them.
+
+        A write that timed out for its caller may still be running, and
+        drain has to wait for it.
+        """
+        self._writes = admission
+
+    def _write(self, func, *args, **kwargs):
+        done = self._writes.pending_write() if self._writes else None
+        return self._call(func, *args, done=done, **kwargs)
+
+    def _gather(self, calls, combine):
+        """Run calls concurrently and pass their results to combine"""
+        if self.executor.mode == 'asyncio':
+            async def gather():
+                return combine(await self.executor.call_many_async(calls))
+            return gather()
+        return combine(self.executor.call_many(calls))
+
+    # Message Operations
+    def save_message(self, message_data, doc_id=None):
+        # The sender retries on failure, so never report a message saved that wasn't
+        return self._write(self._service.save_message, message_data, doc_id=doc_id, fallback=NO_FALLBACK)
+
+    def get_recent_messages(self, room, limit=50, policy=None):
+        return self._call(self._service.get_recent_messages, room, limit, policy=policy,
+                          fallback=[], cache_key=('recent_messages', room, limit))
+
+    def get_seq_seed(self, room):
+        """[newest message] of a room, or [], for seeding its sequence.
+
+        Uncached and without a fallback: an empty or stale result would hand
+        out seqs that are already taken.
+        """
+        return self._call(self._service.get_recent_messages, room, 1, fallback=NO_FALLBACK)
+
+    def delete_message(self, message_id):
+        return self._write(self._service.delete_message, message_id, fallback=False)
+
+    def compact_room(self, room, policy, batch_size=200, archive=False):
+        # Batched and long-running by design: no deadline, but still bounded by the pool
+        return self._write(self._service.compact_room, room, policy, batch_size=batch_size,
+                           archive=archive, fallback=0, timeout=None)
+
+    def get_rooms_snapshot(self, limits, stats_rooms, policy_for):
+        """Recent messages for each room in limits ({room: limit}) and stats for
+        stats_rooms, read concurrently instead of one query after another.
+
+        Returns ({room: messages}, {room: stats}).
+        """
+        history_rooms = list(limits)
+        stats_rooms = list(stats_rooms)
+        calls = [(self._service.get_recent_messages, (room, limits[room]),
+                  {'policy': policy_for(room), 'fallback': [],
+                   'cache_key': ('recent_messages', room, limits[room])})
+                 for room in history_rooms]
+        calls += [(self._service.get_room_stats, (room,),
+                   {'policy': policy_for(room),
+                    'fallback': {'total_messages': 0, 'active_users_24h': 0, 'room': room},
+                    'cache_key': ('room_stats', room)})
+                  for room in stats_rooms]
+
+        def combine(results):
+            split = len(history_rooms)
+            return dict(zip(history_rooms, results[:split])), dict(zip(stats_rooms, results[split:]))
+
+        return self._gather(calls, combine)
+
+    # User Operations
+    def save_user_profile(self, user_data):
+        return self._write(self._service.save_user_profile, user_data, fallback=user_data)
+
+    def get_user_profile(self, user_id):
+        return self._call(self._service.get_user_profile, user_id,
+                          fallback=None, cache_key=('user_profile', user_id))
+
+    def get_online_users(self, room):
+        return self._call(self._service.get_online_users, room,
+                          fallback=[], cache_key=('online_users', room))
+
+    # Analytics and Stats
+    def get_room_stats(self, room, policy=None):
+        return self._call(self._service.get_room_stats, room, policy=policy,
+                          fallback={'total_messages': 0, 'active_users_24h': 0, 'room': room},
+                          cache_key=('room_stats', room))
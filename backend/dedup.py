@@ -0,0 +1,101 @@
+"""
+Idempotent Sends
+
+Clients tag each send_message with a client_msg_id and reuse it when they
+retry. The shard owning the room remembers recent ids per user, so a
+retry (through any worker) is acknowledged with the original message's id
+and seq instead of being stored and broadcast again. A send whose write
+failed or timed out is released for its retry, which writes to the same
+document (write_id), so a timed-out write that still lands is overwritten
+rather than duplicated.
+
+Each user keeps at most max_per_user ids for `window` seconds, and at most
+max_users users are tracked (least recently active evicted first).
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+MAX_CLIENT_MSG_ID = 64
+
+
+def valid_client_msg_id(value):
+    return isinstance(value, str) and 0 < len(value) <= MAX_CLIENT_MSG_ID
+
+
+def write_id(user, client_msg_id):
+    """Datastore document id shared by every retry of a send, or None without a client_msg_id"""
+    if not client_msg_id:
+        return None
+    return hashlib.blake2b(f'{user}\0{client_msg_id}'.encode(), digest_size=16).hexdigest()
+
+
+class DedupCache:
+    """Recent client message ids per user, bounded in time and size"""
+
+    def __init__(self, window=300, max_per_user=256, max_users=100000, clock=time.monotonic):
+        self.window = window
+        self.max_per_user = max_per_user
+        self.max_users = max_users
+        self.clock = clock
+        self._users = OrderedDict()  # user -> OrderedDict(client_msg_id -> (seen_at, ack))
+        self._lock = threading.Lock()
+        self._counters = {'accepted': 0, 'duplicates': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            window=float(os.getenv('DEDUP_WINDOW', '300')),
+            max_per_user=int(os.getenv('DEDUP_MAX_PER_USER', '256')),
+            max_users=int(os.getenv('DEDUP_MAX_USERS', '100000'))
+        )
+
+    def _expire(self, entries, now):
+        # Entries are in insertion order, so expired ones are at the front
+        while entries:
+            _, (seen_at, _) = next(iter(entries.items()))
+            if now - seen_at < self.window:
+                break
+            entries.popitem(last=False)
+
+    def claim(self, user, client_msg_id, ack):
+        """Record a new send, or return the earlier ack if this id was already seen.
+
+        ack is kept by reference, so fields filled in after claiming (seq)
+        are visible to later duplicates.
+        """
+        now = self.clock()
+        with self._lock:
+            entries = self._users.get(user)
+            if entries is None:
+                entries = self._users[user] = OrderedDict()
+            else:
+                self._users.move_to_end(user)
+                self._expire(entries, now)
+
+            previous = entries.get(client_msg_id)
+            if previous is not None:
+                self._counters['duplicates'] += 1
+                return previous[1]
+
+            entries[client_msg_id] = (now, ack)
+            self._counters['accepted'] += 1
+            while len(entries) > self.max_per_user:
+                entries.popitem(last=False)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return None
+
+    def forget(self, user, client_msg_id):
+        """Drop a claim whose write failed so a retry can go through"""
+        with self._lock:
+            entries = self._users.get(user)
+            if entries is not None:
+                entries.pop(client_msg_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'window': self.window, 'users': len(self._users), **self._counters}
@@ -0,0 +1,254 @@
+"""
+Append-Only Event Log for Durable Local Mode
+
+Messages and DM rooms are appended to numbered segment files:
+
+    <dir>/00000001.seg, 00000002.seg, ...
+
+Each record is framed as  length (u32) | crc32 (u32) | type (u8) | JSON body.
+Writes go straight to the OS; fsync is batched by a background flusher
+(sync()), so a crash loses at most the last flush interval. On startup the
+segments are memory-mapped and scanned to rebuild the per-room offset
+index; a torn record at the tail of the last segment is truncated away.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+
+from records import Message
+
+HEADER = struct.Struct('<IIB')
+
+RECORD_MESSAGE = 1
+RECORD_DM = 2
+
+# Index entries pack segment number and byte offset into one integer
+_OFFSET_BITS = 40
+
+
+def _pack(segment, offset):
+    return (segment << _OFFSET_BITS) | offset
+
+
+def _unpack(position):
+    return position >> _OFFSET_BITS, position & ((1 << _OFFSET_BITS) - 1)
+
+
+class RoomIndex:
+    """Positions and timestamps of one room's messages, oldest first"""
+
+    __slots__ = ('positions', 'timestamps')
+
+    def __init__(self):
+        self.positions = array('q')
+        self.timestamps = array('d')
+
+    def append(self, position, timestamp):
+        self.positions.append(position)
+        self.timestamps.append(timestamp)
+
+    def drop_before(self, count):
+        del self.positions[:count]
+        del self.timestamps[:count]
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class EventLog:
+    """Segment-rotated, fsync-batched append-only log with a per-room index"""
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.rooms = {}  # room -> RoomIndex
+        self.dm_rooms = {}  # dm_room_id -> (position, record)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._readers = {}  # sealed segment -> mmap
+        os.makedirs(directory, exist_ok=True)
+
+        segments = self._segments()
+        for segment in segments:
+            self._recover(segment, last=segment == segments[-1])
+        self._segment = segments[-1] if segments else 1
+        self._file = open(self._path(self._segment), 'ab')
+        self._size = self._file.tell()
+
+    @classmethod
+    def from_env(cls):
+        """EventLog under EVENT_LOG_DIR, or None when the log is disabled"""
+        directory = os.getenv('EVENT_LOG_DIR', '')
+        if not directory:
+            return None
+        segment_mb = float(os.getenv('EVENT_LOG_SEGMENT_MB', '64'))
+        return cls(directory, segment_bytes=int(segment_mb * 1024 * 1024))
+
+    # Segments
+    def _path(self, segment):
+        return os.path.join(self.directory, f'{segment:08d}.seg')
+
+    def _segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.seg'))
+
+    def _rotate(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._path(self._segment), 'ab')
+        self._size = 0
+
+    def _recover(self, segment, last):
+        """Index every valid record of a segment; truncate a torn tail"""
+        path = self._path(segment)
+        size = os.path.getsize(path)
+        if size == 0:
+            return
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            while offset + HEADER.size <= size:
+                length, crc, record_type = HEADER.unpack_from(data, offset)
+                end = offset + HEADER.size + length
+                if end > size or zlib.crc32(data[offset + HEADER.size:end]) != crc:
+                    break
+                body = json.loads(data[offset + HEADER.size:end])
+                self._index(record_type, body, _pack(segment, offset))
+                offset = end
+        if offset < size:
+            if not last:
+                raise ValueError(f"Corrupt record in sealed segment {path} at offset {offset}")
+            print(f"WARNING: Truncating torn tail of {path} at offset {offset} ({size - offset} bytes)")
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+
+    def _index(self, record_type, body, position):
+        if record_type == RECORD_MESSAGE:
+            room = self.rooms.get(body['room'])
+            if room is None:
+                room = self.rooms[body['room']] = RoomIndex()
+            room.append(position, body.get('timestamp', 0))
+        elif record_type == RECORD_DM:
+            self.dm_rooms[body['dm_room_id']] = (position, body)
+
+    # Writes
+    def _append(self, record_type, body):
+        payload = json.dumps(body, separators=(',', ':')).encode()
+        with self._lock:
+            if self._size and self._size + HEADER.size + len(payload) > self.segment_bytes:
+                self._rotate()
+            position = _pack(self._segment, self._size)
+            self._file.write(HEADER.pack(len(payload), zlib.crc32(payload), record_type))
+            self._file.write(payload)
+            self._file.flush()
+            self._size += HEADER.size + len(payload)
+            self._dirty = True
+            self._index(record_type, body, position)
+        return position
+
+    def append_message(self, message):
+        """Append a message dict (must carry 'room' and 'timestamp')"""
+        return self._append(RECORD_MESSAGE, message)
+
+    def append_dm(self, dm_room_id, dm_info):
+        """Append (or re-state) a DM room"""
+        return self._append(RECORD_DM, dict(dm_info, dm_room_id=dm_room_id))
+
+    def sync(self):
+        """fsync pending writes; returns True if anything was flushed"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            self._dirty = False
+            fileno = self._file.fileno()
+        os.fsync(fileno)
+        return True
+
+    # Reads
+    def _read(self, position):
+        segment, offset = _unpack(position)
+        if segment == self._segment:
+            with open(self._path(segment), 'rb') as f:
+                f.seek(offset)
+                length, _, _ = HEADER.unpack(f.read(HEADER.size))
+                return json.loads(f.read(length))
+        data = self._readers.get(segment)
+        if data is None:
+            with open(self._path(segment), 'rb') as f:
+                data = self._readers[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        length, _, _ = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        return json.loads(data[start:start + length])
+
+    def recent(self, room, limit):
+        """Last `limit` message dicts logged for a room, oldest first"""
+        index = self.rooms.get(room)
+        if not index:
+            return []
+        return [self._read(position) for position in index.positions[-limit:]]
+
+    def restore(self, history, dm_rooms):
+        """Load each room's retained tail into a RoomHistory and DM rooms into dm_rooms"""
+        loaded = 0
+        for room in list(self.rooms):
+            limit = history.config.policy_for(room).max_messages or len(self.rooms[room])
+            for data in self.recent(room, limit):
+                history.append(Message.from_dict(data))
+                loaded += 1
+        for dm_room_id, (_, body) in self.dm_rooms.items():
+            dm_rooms[dm_room_id] = {k: v for k, v in body.items() if k != 'dm_room_id'}
+        history.compact()
+        return loaded
+
+    # Compaction
+    def compact(self, config, now=None):
+        """Drop index entries outside each room's retention policy and delete
+        segments nothing references any more. DM records living in those
+        segments are re-appended first. Returns the number of segments removed.
+        """
+        with self._lock:
+            for room, index in list(self.rooms.items()):
+                policy = config.policy_for(room)
+                drop = 0
+                if policy.max_messages is not None:
+                    drop = max(0, len(index) - policy.max_messages)
+                cutoff = policy.cutoff(now)
+                if cutoff is not None:
+                    while drop < len(index) and index.timestamps[drop] < cutoff:
+                        drop += 1
+                if drop:
+                    index.drop_before(drop)
+                if not len(index):
+                    del self.rooms[room]
+
+            live = [_unpack(index.positions[0])[0] for index in self.rooms.values()]
+            oldest_needed = min(live, default=self._segment)
+            stale_dms = [body for position, body in self.dm_rooms.values()
+                         if _unpack(position)[0] < oldest_needed]
+
+        for body in stale_dms:
+            self._append(RECORD_DM, body)
+
+        removed = 0
+        for segment in self._segments():
+            if segment >= oldest_needed or segment == self._segment:
+                break
+            reader = self._readers.pop(segment, None)
+            if reader is not None:
+                reader.close()
+            os.remove(self._path(segment))
+            removed += 1
+        return removed
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            self._file.close()
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
@@ -4,9 +4,13 @@ Firebase Configuration and Initialization
 
 import os
 import json
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
-from google.cloud import firestore as firestore_client
+import threading
+import time
+
+import queries
+
+# firebase_admin and google.cloud.firestore are imported in initialize() only
+# when credentials are configured: they dominate cold-start import time
 
 class FirebaseConfig:
     """Firebase configuration and service initialization"""
@@ -16,26 +20,36 @@ class FirebaseConfig:
         self.db = None
         self.auth_client = None
         self._initialized = False
+        self._lock = threading.Lock()
     
     def initialize(self):
-        """Initialize Firebase services"""
+        """Initialize Firebase services (once, on first use)"""
         if self._initialized:
             return
         
+        with self._lock:
+            if not self._initialized:
+                self._initialize()
+    
+    def _initialize(self):
         try:
+            if not (os.getenv('FIREBASE_SERVICE_ACCOUNT_KEY') or os.getenv('GOOGLE_APPLICATION_CREDENTIALS')):
+                # For development, use mock credentials
+                print("WARNING: No Firebase credentials found - using mock mode for development")
+                self._initialize_mock_mode()
+                return
+            
+            import firebase_admin
+            from firebase_admin import credentials, auth, firestore
+            
             # Initialize Firebase Admin SDK
             if os.getenv('FIREBASE_SERVICE_ACCOUNT_KEY'):
                 # Use service account key from environment variable
                 service_account_info = json.loads(os.getenv('FIREBASE_SERVICE_ACCOUNT_KEY'))
                 cred = credentials.Certificate(service_account_info)
-            elif os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
+            else:
                 # Use service account key file path
                 cred = credentials.Certificate(os.getenv('GOOGLE_APPLICATION_CREDENTIALS'))
-            else:
-                # For development, use mock credentials
-                print("WARNING: No Firebase credentials found - using mock mode for development")
-                self._initialize_mock_mode()
-                return
             
             # Initialize Firebase app
             self.app = firebase_admin.initialize_app(cred, {
@@ -94,6 +108,11 @@ class FirebaseConfig:
             print(f"ERROR: Token verification failed: {e}")
             return None
     
+    async def verify_token_async(self, token):
+        """Verify Firebase ID token on the blocking pool (asyncio mode)"""
+        from blocking import run_blocking
+        return await run_blocking(self.verify_token, token)
+    
     def get_firestore(self):
         """Get Firestore client"""
         if not self._initialized:
@@ -117,6 +136,15 @@ class MockAuth:
         raise Exception("Invalid dev token")
 
 
+# Simulated round-trip latency for mock reads/writes (benchmarks)
+MOCK_LATENCY = float(os.getenv('MOCK_FIRESTORE_LATENCY_MS', '0')) / 1000
+
+
+def _mock_round_trip():
+    if MOCK_LATENCY:
+        time.sleep(MOCK_LATENCY)
+
+
 class MockFirestore:
     """Mock Firestore for development"""
     
@@ -127,6 +155,9 @@ class MockFirestore:
         if name not in self._collections:
             self._collections[name] = MockCollection(name)
         return self._collections[name]
+    
+    def batch(self):
+        return MockWriteBatch()
 
 
 class MockCollection:
@@ -135,26 +166,31 @@ class MockCollection:
     def __init__(self, name):
         self.name = name
         self._documents = {}
+        self._next_id = 0
+    
+    def _new_id(self):
+        doc_id = f"doc_{self._next_id}"
+        self._next_id += 1
+        return doc_id
     
     def document(self, doc_id=None):
         if doc_id is None:
-            doc_id = f"doc_{len(self._documents)}"
+            doc_id = self._new_id()
         return MockDocument(self, doc_id)
     
     def add(self, data):
-        doc_id = f"doc_{len(self._documents)}"
-        doc = MockDocument(self, doc_id)
+        doc = MockDocument(self, self._new_id())
         doc.set(data)
         return doc
     
     def where(self, field, op, value):
-        return MockQuery(self, field, op, value)
+        return MockQuery(self).where(field, op, value)
     
     def order_by(self, field, direction=None):
-        return MockQuery(self, order_field=field, order_direction=direction)
+        return MockQuery(self).order_by(field, direction)
     
     def limit(self, count):
-        return MockQuery(self, limit_count=count)
+        return MockQuery(self).limit(count)
 
 
 class MockDocument:
@@ -166,12 +202,17 @@ class MockDocument:
         self._data = {}
     
     def set(self, data):
+        _mock_round_trip()
         self.collection._documents[self.id] = data.copy()
         print(f"Mock Firestore: Set document {self.id} in {self.collection.name}")
     
     def get(self):
+        _mock_round_trip()
         return MockDocumentSnapshot(self.id, self.collection._documents.get(self.id))
     
+    def delete(self):
+        self.collection._documents.pop(self.id, None)
+    
     def to_dict(self):
         return self.collection._documents.get(self.id, {})
 
@@ -190,37 +231,153 @@ class MockDocumentSnapshot:
         return self._data.copy() if self._data else {}
 
 
+class MockWriteBatch:
+    """Mock Firestore write batch, applied on commit"""
+    
+    def __init__(self):
+        self._ops = []
+    
+    def set(self, doc_ref, data):
+        self._ops.append(lambda: doc_ref.set(data))
+    
+    def delete(self, doc_ref):
+        self._ops.append(doc_ref.delete)
+    
+    def commit(self):
+        for op in self._ops:
+            op()
+        self._ops = []
+
+
+_MOCK_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+}
+
+
+# Queries needing a composite index missing from firestore.indexes.json:
+# strict raises like Firestore does, warn prints once per shape, off skips the check
+MOCK_INDEX_CHECK = os.getenv('MOCK_FIRESTORE_INDEX_CHECK', 'strict')
+
+
+class MockIndexError(Exception):
+    """Query requires a composite index that is not declared"""
+
+
+class MockQueryStats:
+    """Read units billed per query name (one per document read, at least one per query)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._declared = None
+        self._warned = set()
+    
+    def check_index(self, query):
+        if MOCK_INDEX_CHECK == 'off':
+            return
+        fields = [(field, op) for field, op, _ in query.filters]
+        index = queries.index_for(query.collection.name, fields, query.order_field, query.order_direction)
+        if index is None:
+            return
+        if self._declared is None:
+            self._declared = queries.load_manifest()
+        if queries.is_declared(index, self._declared):
+            return
+        message = (f"Query {query.name or '<undeclared>'} requires a composite index not in "
+                   f"firestore.indexes.json: {json.dumps(index)}")
+        if MOCK_INDEX_CHECK == 'strict':
+            raise MockIndexError(message)
+        if message not in self._warned:
+            self._warned.add(message)
+            print(f"WARNING: {message}")
+    
+    def record(self, query, reads):
+        name = query.name or f"<undeclared {query.collection.name}>"
+        with self._lock:
+            entry = self._stats.setdefault(name, {'executions': 0, 'reads': 0, 'max_reads': 0})
+            entry['executions'] += 1
+            entry['reads'] += reads
+            entry['max_reads'] = max(entry['max_reads'], reads)
+    
+    def report(self):
+        with self._lock:
+            return {name: dict(entry, avg_reads=round(entry['reads'] / entry['executions'], 1))
+                    for name, entry in sorted(self._stats.items())}
+    
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+# Global mock query accounting
+mock_query_stats = MockQueryStats()
+
+
 class MockQuery:
     """Mock Firestore query"""
     
-    def __init__(self, collection, field=None, op=None, value=None, 
-                 order_field=None, order_direction=None, limit_count=None):
+    def __init__(self, collection, filters=(), order_field=None, order_direction=None,
+                 limit_count=None, offset_count=0, name=None):
         self.collection = collection
-        self.field = field
-        self.op = op
-        self.value = value
+        self.filters = tuple(filters)
         self.order_field = order_field
         self.order_direction = order_direction
         self.limit_count = limit_count
+        self.offset_count = offset_count
+        self.name = name
+    
+    def _copy(self, **changes):
+        params = {
+            'filters': self.filters,
+            'order_field': self.order_field,
+            'order_direction': self.order_direction,
+            'limit_count': self.limit_count,
+            'offset_count': self.offset_count,
+            'name': self.name,
+        }
+        params.update(changes)
+        return MockQuery(self.collection, **params)
     
     def where(self, field, op, value):
-        return MockQuery(self.collection, field, op, value, 
-                        self.order_field, self.order_direction, self.limit_count)
+        return self._copy(filters=self.filters + ((field, op, value),))
     
     def order_by(self, field, direction=None):
-        return MockQuery(self.collection, self.field, self.op, self.value,
-                        field, direction, self.limit_count)
+        return self._copy(order_field=field, order_direction=direction)
     
     def limit(self, count):
-        return MockQuery(self.collection, self.field, self.op, self.value,
-                        self.order_field, self.order_direction, count)
+        return self._copy(limit_count=count)
+    
+    def offset(self, count):
+        return self._copy(offset_count=count)
+    
+    def label(self, name):
+        """Attach the declared query name used for cost reporting"""
+        return self._copy(name=name)
     
     def stream(self):
-        # Return mock documents for development
-        docs = []
-        for doc_id, data in list(self.collection._documents.items())[:self.limit_count or 10]:
-            docs.append(MockDocumentSnapshot(doc_id, data))
-        return docs
+        mock_query_stats.check_index(self)
+        _mock_round_trip()
+        # Evaluate filters, ordering, offset and limit against stored documents
+        items = [
+            (doc_id, data) for doc_id, data in self.collection._documents.items()
+            if all(_MOCK_OPERATORS[op](data.get(field), value) for field, op, value in self.filters)
+        ]
+        if self.order_field:
+            items.sort(key=lambda item: item[1].get(self.order_field) or 0,
+                       reverse=self.order_direction == 'DESCENDING')
+        # Documents skipped by offset are still billed
+        skipped = min(self.offset_count, len(items))
+        items = items[self.offset_count:]
+        if self.limit_count is not None:
+            items = items[:self.limit_count]
+        mock_query_stats.record(self, max(1, skipped + len(items)))
+        return [MockDocumentSnapshot(doc_id, data) for doc_id, data in items]
 
 
 # Global Firebase instance
@@ -0,0 +1,118 @@
+"""
+Membership Event Aggregation
+
+Joins and leaves are collected per room and broadcast once per window as
+a single membership_delta frame instead of one user_joined / user_left
+(plus typing_update) frame per user:
+
+    {"room": "general", "member_count": 42, "joined_count": 3, "left_count": 1,
+     "joined": [{"user_id": ..., "username": ...}], "left": [...],
+     "typing_users": [...]}            # only when a leaving user was typing
+
+Rooms with more than count_only_above members get counts only, and name
+lists are capped at max_names entries.
+"""
+
+import os
+import threading
+from collections import Counter
+
+
+class RoomDelta:
+    """Pending joins and leaves for one room"""
+
+    __slots__ = ('joined', 'left', 'typing_changed')
+
+    def __init__(self):
+        self.joined = {}  # user_id -> username
+        self.left = {}
+        self.typing_changed = False
+
+
+class MembershipAggregator:
+    """Coalesces membership changes per room into one frame per window"""
+
+    def __init__(self, window=0.5, count_only_above=500, max_names=50):
+        self.window = window
+        self.count_only_above = count_only_above
+        self.max_names = max_names
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._frames = 0
+        self._events = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            window=float(os.getenv('MEMBERSHIP_WINDOW', '0.5')),
+            count_only_above=int(os.getenv('MEMBERSHIP_COUNT_ONLY_ABOVE', '500')),
+            max_names=int(os.getenv('MEMBERSHIP_MAX_NAMES', '50'))
+        )
+
+    def _delta(self, room):
+        delta = self._pending.get(room)
+        if delta is None:
+            delta = self._pending[room] = RoomDelta()
+        return delta
+
+    def joined(self, room, user_id, username):
+        with self._lock:
+            self._events += 1
+            delta = self._delta(room)
+            # Left and came back within the window: nothing changed
+            if delta.left.pop(user_id, None) is None:
+                delta.joined[user_id] = username
+
+    def left(self, room, user_id, username, typing=False):
+        with self._lock:
+            self._events += 1
+            delta = self._delta(room)
+            if delta.joined.pop(user_id, None) is None:
+                delta.left[user_id] = username
+            delta.typing_changed = delta.typing_changed or typing
+
+    def _names(self, users):
+        return [{'user_id': uid, 'username': name} for uid, name in list(users.items())[:self.max_names]]
+
+    def flush(self, sessions, typing_users_for):
+        """Build the frames for everything collected since the last flush.
+
+        sessions is an iterable of connected sessions (for member counts),
+        typing_users_for(room) returns the room's typing usernames.
+        Returns a list of (room, frame).
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return []
+
+        counts = Counter(session.room for session in sessions)
+        frames = []
+        for room, delta in pending.items():
+            if not (delta.joined or delta.left or delta.typing_changed):
+                continue
+            frame = {
+                'room': room,
+                'member_count': counts.get(room, 0),
+                'joined_count': len(delta.joined),
+                'left_count': len(delta.left)
+            }
+            if frame['member_count'] <= self.count_only_above:
+                frame['joined'] = self._names(delta.joined)
+                frame['left'] = self._names(delta.left)
+            if delta.typing_changed:
+                frame['typing_users'] = typing_users_for(room)
+            frames.append((room, frame))
+
+        with self._lock:
+            self._frames += len(frames)
+        return frames
+
+    def stats(self):
+        with self._lock:
+            return {
+                'window': self.window,
+                'pending_rooms': len(self._pending),
+                'events': self._events,
+                'frames': self._frames
+            }
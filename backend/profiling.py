@@ -0,0 +1,199 @@
+"""
+On-Demand Profiling of the Live Server
+
+A sampling CPU profiler and tracemalloc allocation snapshot that only run
+for the requested window; nothing is hooked in while idle.
+
+    curl -H "X-Admin-Token: $PROFILE_TOKEN" "http://host:5000/admin/profile?seconds=10&format=collapsed" \\
+        | flamegraph.pl > cpu.svg
+    kill -USR2 <pid>        # writes profile-<time>.collapsed / .alloc.txt to PROFILE_DIR
+
+The CPU profile is in collapsed-stack format (one "frame;frame;frame count"
+line per unique stack), readable by flamegraph.pl, speedscope and inferno.
+Allocation tracing slows allocation-heavy code several times over while it
+runs; pass alloc=0 for a CPU-only profile of a hot server.
+"""
+
+import hmac
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+
+class ProfilerBusy(Exception):
+    """A profile is already being taken"""
+
+
+def _frame_label(code):
+    path = code.co_filename.replace('\\', '/').rsplit('/', 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples every thread's stack from a background thread"""
+
+    def __init__(self, interval=0.01, alloc_frames=5, top=25):
+        self.interval = interval
+        self.alloc_frames = alloc_frames
+        self.top = top
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stacks = Counter()
+        self._samples = 0
+        self._started_at = None
+        self._owns_tracemalloc = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            interval=float(os.getenv('PROFILE_INTERVAL', '0.01')),
+            alloc_frames=int(os.getenv('PROFILE_ALLOC_FRAMES', '5')),
+            top=int(os.getenv('PROFILE_TOP', '25'))
+        )
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, allocations=True):
+        with self._lock:
+            if self._thread is not None:
+                raise ProfilerBusy("A profile is already running")
+            self._stacks = Counter()
+            self._samples = 0
+            self._started_at = time.time()
+            self._stop.clear()
+            self._owns_tracemalloc = allocations and not tracemalloc.is_tracing()
+            if self._owns_tracemalloc:
+                tracemalloc.start(self.alloc_frames)
+            # A real OS thread, so it keeps sampling while the event loop is busy
+            self._thread = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self):
+        # Samples are counted as (thread name, code objects...) and only formatted in the report
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if frames.keys() - names.keys():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                name = names.get(ident)
+                if ident == own or name == 'profile-signal':
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.append(name or f'thread-{ident}')
+                self._stacks[tuple(stack)] += 1
+            self._samples += 1
+
+    def stop(self):
+        """Stop sampling and return the report"""
+        with self._lock:
+            if self._thread is None:
+                raise ProfilerBusy("No profile is running")
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+        return {
+            'seconds': round(time.time() - self._started_at, 3),
+            'interval': self.interval,
+            'samples': self._samples,
+            'collapsed': self.collapsed(),
+            'allocations': self._allocations(snapshot)
+        }
+
+    def collapsed(self):
+        labels = {}
+        lines = []
+        for stack, count in self._stacks.most_common():
+            frames = [stack[-1]]
+            for code in reversed(stack[:-1]):
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                frames.append(label)
+            lines.append(f"{';'.join(frames)} {count}")
+        return '\n'.join(lines)
+
+    def _allocations(self, snapshot):
+        """Top allocating call sites still live at the end of the window"""
+        if snapshot is None:
+            return []
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)
+        ])
+        return [
+            {
+                'site': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                'size_kb': round(stat.size / 1024, 1),
+                'count': stat.count,
+                'stack': [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback]
+            }
+            for stat in snapshot.statistics('lineno')[:self.top]
+        ]
+
+    def run(self, seconds, sleep=time.sleep, allocations=True):
+        """Profile for `seconds`; pass the server's sleep so the event loop keeps running"""
+        self.start(allocations)
+        try:
+            sleep(seconds)
+        finally:
+            report = self.stop()
+        return report
+
+
+def authorized(token, expected):
+    """Admin check for the profile endpoint; disabled when PROFILE_TOKEN is unset"""
+    return bool(expected) and hmac.compare_digest(token or '', expected)
+
+
+def format_allocations(allocations):
+    lines = [f"{'size KiB':>10}{'count':>9}  site"]
+    for entry in allocations:
+        lines.append(f"{entry['size_kb']:>10}{entry['count']:>9}  {entry['site']}")
+    return '\n'.join(lines)
+
+
+def write_report(report, directory):
+    """Write a report as profile-<time>.collapsed and profile-<time>.alloc.txt, returns the path prefix"""
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, time.strftime('profile-%Y%m%d-%H%M%S'))
+    with open(f'{prefix}.collapsed', 'w') as f:
+        f.write(report['collapsed'] + '\n')
+    with open(f'{prefix}.alloc.txt', 'w') as f:
+        f.write(format_allocations(report['allocations']) + '\n')
+    return prefix
+
+
+def install_signal_handler(profiler, seconds, directory, signum=None):
+    """Profile for `seconds` and write the report to `directory` on SIGUSR2"""
+    signum = signum or getattr(signal, 'SIGUSR2', None)
+    if signum is None:
+        return  # Not available on Windows
+
+    def profile_to_files():
+        try:
+            prefix = write_report(profiler.run(seconds), directory)
+            print(f"Profile written to {prefix}.collapsed / .alloc.txt")
+        except ProfilerBusy as e:
+            print(f"WARNING: {e}")
+        except Exception as e:
+            print(f"ERROR: Profiling failed: {e}")
+
+    def on_signal(signum, frame):
+        threading.Thread(target=profile_to_files, name='profile-signal', daemon=True).start()
+
+    signal.signal(signum, on_signal)
@@ -0,0 +1,158 @@
+"""
+Firestore Query Declarations and Index Manifest
+
+Every query DatabaseService runs is declared here. The composite indexes
+they need are derived from the declarations and written to
+firestore.indexes.json (deploy with `firebase deploy --only firestore:indexes`):
+
+    python queries.py            # regenerate the manifest
+    python queries.py --check    # exit 1 if the manifest is out of date
+"""
+
+import json
+import os
+import sys
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'firestore.indexes.json')
+
+EQUALITY_OPERATORS = ('==', 'in')
+
+
+class QueryIndexError(Exception):
+    """A query shape Firestore cannot serve or has no declared index for"""
+
+
+def index_for(collection, filters, order_field=None, direction=None):
+    """Composite index a query needs, or None when single-field indexes suffice.
+
+    filters is a sequence of (field, op); the index lists equality fields
+    first and ends with the range / sort field.
+    """
+    equality = sorted({field for field, op in filters if op in EQUALITY_OPERATORS})
+    ranged = {field for field, op in filters if op not in EQUALITY_OPERATORS}
+    if len(ranged) > 1:
+        raise QueryIndexError(f"Range filters on more than one field: {sorted(ranged)}")
+    if ranged and order_field and order_field not in ranged:
+        raise QueryIndexError(f"First order_by must be on the range field {ranged.pop()}")
+
+    sort_field = order_field or (ranged.pop() if ranged else None)
+    equality = [field for field in equality if field != sort_field]
+    if not sort_field or not equality:
+        return None
+    return {
+        'collectionGroup': collection,
+        'queryScope': 'COLLECTION',
+        'fields': [{'fieldPath': field, 'order': 'ASCENDING'} for field in equality] +
+                  [{'fieldPath': sort_field, 'order': (direction or 'ASCENDING') if order_field else 'ASCENDING'}]
+    }
+
+
+def _index_key(index):
+    fields = [(field['fieldPath'], field['order']) for field in index['fields']]
+    return index['collectionGroup'], tuple(sorted(fields[:-1])), fields[-1]
+
+
+class QuerySpec:
+    """A named query shape: equality filters, an optional range field and ordering"""
+
+    __slots__ = ('name', 'collection', 'equality', 'range_field', 'order_field', 'direction')
+
+    def __init__(self, name, collection, equality=(), range_field=None, order_field=None,
+                 direction='ASCENDING'):
+        self.name = name
+        self.collection = collection
+        self.equality = tuple(equality)
+        self.range_field = range_field
+        self.order_field = order_field
+        self.direction = direction
+
+    def build(self, db, values, bounds=(), limit=None, offset=0):
+        """Build the query; values maps equality fields, bounds are (op, value) on range_field"""
+        query = db.collection(self.collection)
+        for field in self.equality:
+            query = query.where(field, '==', values[field])
+        for op, value in bounds:
+            query = query.where(self.range_field, op, value)
+        if self.order_field:
+            query = query.order_by(self.order_field, direction=self.direction)
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        # The mock engine attributes read costs to the declared name
+        if hasattr(query, 'label'):
+            query = query.label(self.name)
+        return query
+
+    def index(self):
+        filters = [(field, '==') for field in self.equality]
+        if self.range_field:
+            filters.append((self.range_field, '>='))
+        return index_for(self.collection, filters, self.order_field, self.direction)
+
+    def __repr__(self):
+        return f"QuerySpec({self.name!r})"
+
+
+# Messages
+RECENT_MESSAGES = QuerySpec('recent_messages', 'messages', equality=('room',),
+                            range_field='server_timestamp', order_field='server_timestamp',
+                            direction='DESCENDING')
+EXPIRED_MESSAGES = QuerySpec('expired_messages', 'messages', equality=('room',),
+                             range_field='server_timestamp')
+OVERFLOW_MESSAGES = QuerySpec('overflow_messages', 'messages', equality=('room',),
+                              order_field='server_timestamp', direction='DESCENDING')
+ROOM_MESSAGE_COUNT = QuerySpec('room_message_count', 'messages', equality=('room',),
+                               range_field='server_timestamp')
+ROOM_ACTIVE_USERS = QuerySpec('room_active_users', 'messages', equality=('room',),
+                              range_field='server_timestamp')
+ROOM_RECENT_SENDERS = QuerySpec('room_recent_senders', 'messages', equality=('room',),
+                                range_field='server_timestamp')
+
+# Rooms
+PUBLIC_ROOMS = QuerySpec('public_rooms', 'rooms', equality=('is_public',))
+
+QUERIES = {spec.name: spec for spec in (
+    RECENT_MESSAGES, EXPIRED_MESSAGES, OVERFLOW_MESSAGES, ROOM_MESSAGE_COUNT,
+    ROOM_ACTIVE_USERS, ROOM_RECENT_SENDERS, PUBLIC_ROOMS,
+)}
+
+
+def manifest():
+    """firestore.indexes.json content for every declared query"""
+    indexes = {}
+    for spec in QUERIES.values():
+        index = spec.index()
+        if index is not None:
+            indexes.setdefault(_index_key(index), index)
+    return {'indexes': [indexes[key] for key in sorted(indexes)], 'fieldOverrides': []}
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Index keys declared in a manifest file (empty when it does not exist)"""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {_index_key(index) for index in json.load(f).get('indexes', [])}
+
+
+def is_declared(index, declared):
+    return _index_key(index) in declared
+
+
+def main():
+    content = json.dumps(manifest(), indent=2) + '\n'
+    if '--check' in sys.argv:
+        current = open(MANIFEST_PATH).read() if os.path.exists(MANIFEST_PATH) else ''
+        if current != content:
+            print(f"ERROR: {MANIFEST_PATH} is out of date, run python queries.py")
+            sys.exit(1)
+        print(f"{MANIFEST_PATH} is up to date")
+        return
+    with open(MANIFEST_PATH, 'w') as f:
+        f.write(content)
+    print(f"Wrote {len(manifest()['indexes'])} indexes to {MANIFEST_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compact In-Memory Records for Sessions and Messages
+"""
+
+import sys
+import uuid
+
+
+def _intern(value):
+    """Intern strings that repeat across records (rooms, usernames, ids)"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Session:
+    """Connected socket session stored in connected_users"""
+
+    __slots__ = ('username', 'user_id', 'joined_at', '_room', 'firebase_uid', 'wire')
+
+    def __init__(self, username, user_id, joined_at, room=None, firebase_uid=None, wire='json'):
+        self.username = _intern(username)
+        self.user_id = _intern(user_id)
+        self.joined_at = joined_at
+        self._room = _intern(room)
+        self.firebase_uid = _intern(firebase_uid)
+        self.wire = _intern(wire)
+
+    @property
+    def room(self):
+        return self._room
+
+    @room.setter
+    def room(self, value):
+        self._room = _intern(value)
+
+    def to_dict(self):
+        return {
+            'username': self.username,
+            'user_id': self.user_id,
+            'joined_at': self.joined_at,
+            'room': self._room,
+            'firebase_uid': self.firebase_uid,
+            'wire': self.wire
+        }
+
+
+class Message:
+    """Chat message kept in the in-memory history buffer"""
+
+    __slots__ = ('_id', 'username', 'message', 'room', 'timestamp', 'user_id', 'firebase_uid', 'seq')
+
+    def __init__(self, username, message, room, timestamp, user_id, firebase_uid=None, id=None, seq=None):
+        # 16 raw bytes instead of a 36 character string
+        self._id = uuid.UUID(id).bytes if id else uuid.uuid4().bytes
+        self.username = _intern(username)
+        self.message = message
+        self.room = _intern(room)
+        self.timestamp = timestamp
+        self.user_id = _intern(user_id)
+        self.firebase_uid = _intern(firebase_uid)
+        self.seq = seq  # Room sequence number assigned by the owning shard
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            username=data['username'],
+            message=data['message'],
+            room=data['room'],
+            timestamp=data['timestamp'],
+            user_id=data['user_id'],
+            firebase_uid=data.get('firebase_uid'),
+            id=data['id'],
+            seq=data.get('seq')
+        )
+
+    @property
+    def id(self):
+        return str(uuid.UUID(bytes=self._id))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'message': self.message,
+            'room': self.room,
+            'timestamp': self.timestamp,
+            'user_id': self.user_id,
+            'firebase_uid': self.firebase_uid,
+            'seq': self.seq
+        }
@@ -0,0 +1,196 @@
+"""
+Room History Retention and Compaction
+"""
+
+import os
+import time
+from collections import OrderedDict, deque
+from fnmatch import fnmatch
+
+
+class RetentionPolicy:
+    """Keep at most max_messages newer than max_age seconds (None = unlimited)"""
+
+    __slots__ = ('max_messages', 'max_age')
+
+    def __init__(self, max_messages=None, max_age=None):
+        self.max_messages = max_messages
+        self.max_age = max_age
+
+    def cutoff(self, now=None):
+        """Oldest timestamp still retained, or None when age is unlimited"""
+        if self.max_age is None:
+            return None
+        return (now or time.time()) - self.max_age
+
+    def __repr__(self):
+        return f"RetentionPolicy(max_messages={self.max_messages}, max_age={self.max_age})"
+
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(value):
+    """Parse '3600', '90m', '12h' or '7d' into seconds; '' or '0' means unlimited"""
+    value = (value or '').strip().lower()
+    if not value or value == '0':
+        return None
+    if value[-1] in _DURATION_UNITS:
+        return float(value[:-1]) * _DURATION_UNITS[value[-1]]
+    return float(value)
+
+
+def parse_count(value):
+    value = (value or '').strip()
+    if not value or value == '0':
+        return None
+    return int(value)
+
+
+class RetentionConfig:
+    """Per-room retention policies matched by glob pattern"""
+
+    def __init__(self, default, rules=None):
+        self.default = default
+        self.rules = rules or []
+
+    @classmethod
+    def from_spec(cls, spec, default):
+        """Build from a spec such as 'general=1000:7d,dm_*=500:30d'.
+
+        Each rule is pattern=max_messages:max_age; either side may be left
+        empty (or 0) for no limit. The first matching pattern wins.
+        """
+        rules = []
+        for entry in filter(None, (part.strip() for part in (spec or '').split(','))):
+            pattern, _, limits = entry.partition('=')
+            count, _, age = limits.partition(':')
+            rules.append((pattern.strip(), RetentionPolicy(parse_count(count), parse_duration(age))))
+        return cls(default, rules)
+
+    @classmethod
+    def from_env(cls):
+        """RETENTION_MAX_MESSAGES / RETENTION_MAX_AGE by default, ROOM_RETENTION overrides.
+
+        Unlimited unless configured: compaction permanently deletes persisted history.
+        """
+        default = RetentionPolicy(
+            max_messages=parse_count(os.getenv('RETENTION_MAX_MESSAGES', '')),
+            max_age=parse_duration(os.getenv('RETENTION_MAX_AGE', ''))
+        )
+        return cls.from_spec(os.getenv('ROOM_RETENTION', ''), default)
+
+    def policy_for(self, room):
+        for pattern, policy in self.rules:
+            if fnmatch(room, pattern):
+                return policy
+        return self.default
+
+
+class RoomHistory:
+    """In-memory message history kept per room under its retention policy.
+
+    Memory stays bounded even when retention is unlimited: each room keeps
+    at most max_room_messages, and past max_rooms the least recently
+    written room is evicted.
+    """
+
+    def __init__(self, config, max_room_messages=1000, max_rooms=10000):
+        self.config = config
+        self.max_room_messages = max_room_messages
+        self.max_rooms = max_rooms
+        self._rooms = OrderedDict()
+        self.evicted_rooms = 0
+
+    @classmethod
+    def from_env(cls, config):
+        return cls(
+            config,
+            max_room_messages=int(os.getenv('HISTORY_MAX_ROOM_MESSAGES', '1000')),
+            max_rooms=int(os.getenv('HISTORY_MAX_ROOMS', '10000'))
+        )
+
+    def _buffer(self, room):
+        buffer = self._rooms.get(room)
+        if buffer is None:
+            limit = self.config.policy_for(room).max_messages
+            if limit is None or limit > self.max_room_messages:
+                limit = self.max_room_messages
+            buffer = deque(maxlen=limit)
+            self._rooms[room] = buffer
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+                self.evicted_rooms += 1
+        else:
+            self._rooms.move_to_end(room)
+        return buffer
+
+    def _expire(self, room, buffer, now=None):
+        """Drop messages older than the room's age limit, returns count removed"""
+        cutoff = self.config.policy_for(room).cutoff(now)
+        removed = 0
+        if cutoff is not None:
+            while buffer and buffer[0].timestamp < cutoff:
+                buffer.popleft()
+                removed += 1
+        return removed
+
+    def append(self, message):
+        self._buffer(message.room).append(message)
+
+    def recent(self, room, limit=50):
+        """Last `limit` retained messages for a room, oldest first"""
+        buffer = self._rooms.get(room)
+        if not buffer:
+            return []
+        self._expire(room, buffer)
+        start = max(0, len(buffer) - limit)
+        return [buffer[i] for i in range(start, len(buffer))]
+
+    def count(self, room):
+        buffer = self._rooms.get(room)
+        if not buffer:
+            return 0
+        self._expire(room, buffer)
+        return len(buffer)
+
+    def rooms(self):
+        return list(self._rooms)
+
+    def drop(self, room):
+        """Forget a room's history, returns its messages"""
+        return list(self._rooms.pop(room, ()))
+
+    def compact(self, now=None):
+        """Expire aged messages in every room and drop empty rooms"""
+        removed = 0
+        for room, buffer in list(self._rooms.items()):
+            removed += self._expire(room, buffer, now)
+            if not buffer:
+                del self._rooms[room]
+        return removed
+
+    def __len__(self):
+        return sum(len(buffer) for buffer in self._rooms.values())
+
+
+def compaction_targets(config, rooms):
+    """(room, policy) for each of the rooms whose policy limits its history"""
+    targets = []
+    for room in rooms:
+        policy = config.policy_for(room)
+        if policy.max_messages is not None or policy.max_age is not None:
+            targets.append((room, policy))
+    return targets
+
+
+def compact_rooms(db_service, config, rooms, batch_size=200, archive=False):
+    """Apply retention to persisted history for the given rooms.
+
+    Deletes (or archives) expired messages through DatabaseService in
+    batches of batch_size. Returns the number of messages removed.
+    """
+    removed = 0
+    for room, policy in compaction_targets(config, rooms):
+        removed += db_service.compact_room(room, policy, batch_size=batch_size, archive=archive)
+    return removed
@@ -3,7 +3,11 @@
 Realtime Chat Backend - Main Entry Point
 """
 
+import asyncio
 import os
+import secrets
+import signal
+import subprocess
 import sys
 from pathlib import Path
 
@@ -11,7 +15,105 @@ from pathlib import Path
 backend_dir = Path(__file__).parent
 sys.path.insert(0, str(backend_dir))
 
-from app import app, socketio
+from dotenv import load_dotenv
+load_dotenv()
+
+# flask: Flask-SocketIO (eventlet/threading), asgi: python-socketio AsyncServer on uvicorn
+SERVER_MODE = os.getenv('SERVER_MODE', 'flask')
+
+def install_drain_handler(socketio, drain):
+    """Drain connections and flush writes on SIGTERM before exiting"""
+    def shutdown():
+        drain()
+        print("🛑 Shut down after drain")
+        sys.stdout.flush()
+        os._exit(0)
+
+    def on_sigterm(signum, frame):
+        # Run the drain on the server's own loop rather than inside the signal frame
+        socketio.start_background_task(shutdown)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+def install_profile_handler(profiler):
+    """Profile for PROFILE_SIGNAL_SECONDS on SIGUSR2, writing the report to PROFILE_DIR"""
+    from profiling import install_signal_handler
+    install_signal_handler(profiler, float(os.getenv('PROFILE_SIGNAL_SECONDS', '10')),
+                           os.getenv('PROFILE_DIR', 'profiles'))
+
+def run_flask(host, port, debug, dev_mode):
+    """Run the Flask-SocketIO server"""
+    from app import app, socketio, drain, start_background_tasks, profiler
+    
+    install_drain_handler(socketio, drain)
+    install_profile_handler(profiler)
+    start_background_tasks()
+    
+    # Under eventlet the reloader serves from another thread, whose hub never runs the background tasks
+    socketio.run(
+        app, 
+        debug=debug, 
+        host=host, 
+        port=port,
+        use_reloader=dev_mode and socketio.async_mode != 'eventlet',
+        log_output=dev_mode,
+        allow_unsafe_werkzeug=dev_mode  # Only for development
+    )
+
+def run_asgi(host, port, dev_mode):
+    """Run the asyncio Socket.IO server on uvicorn"""
+    import uvicorn
+    from asgi_app import app, admission, drain, profiler
+    
+    install_profile_handler(profiler)
+    
+    class DrainingServer(uvicorn.Server):
+        """uvicorn server that drains Socket.IO clients before shutting down"""
+        
+        def handle_exit(self, sig, frame):
+            # A second signal (or one arriving mid-drain) falls through to uvicorn
+            if admission.draining or sig != signal.SIGTERM:
+                return super().handle_exit(sig, frame)
+            admission.start_drain()
+            loop = asyncio.get_event_loop()
+            loop.call_soon_threadsafe(lambda: loop.create_task(self._drain_then_exit(sig, frame)))
+        
+        async def _drain_then_exit(self, sig, frame):
+            await drain()
+            print("🛑 Shut down after drain")
+            super().handle_exit(sig, frame)
+    
+    config = uvicorn.Config(app, host=host, port=port,
+                            log_level='info' if dev_mode else 'warning',
+                            ws_per_message_deflate=os.getenv('WS_PERMESSAGE_DEFLATE', '1') == '1')
+    DrainingServer(config).run()
+
+def run_shards(workers, host, port):
+    """Run one worker process per shard on consecutive ports, forwarding SIGTERM to each"""
+    peer_host = '127.0.0.1' if host == '0.0.0.0' else host
+    peers = ','.join(f"{i}=http://{peer_host}:{port + i}" for i in range(workers))
+    secret = os.getenv('SHARD_SECRET')
+    if not secret:
+        secret = secrets.token_hex(32)
+        print("No SHARD_SECRET set, generated one for this run (set it to rebalance these workers)")
+    event_log_dir = os.getenv('EVENT_LOG_DIR')
+    procs = []
+    for i in range(workers):
+        env = dict(os.environ, SHARD_WORKERS='1', SHARD_ID=str(i), SHARD_PEERS=peers, PORT=str(port + i),
+                   SHARD_SECRET=secret)
+        if event_log_dir:
+            # One log per worker: shared segments would interleave writes and replay other shards' rooms
+            env['EVENT_LOG_DIR'] = os.path.join(event_log_dir, f'shard-{i}')
+        procs.append(subprocess.Popen([sys.executable, __file__], env=env))
+    print(f"Started {workers} shard workers on ports {port}-{port + workers - 1}")
+    
+    def on_sigterm(signum, frame):
+        for proc in procs:
+            proc.send_signal(signal.SIGTERM)
+    
+    signal.signal(signal.SIGTERM, on_sigterm)
+    for proc in procs:
+        proc.wait()
 
 def main():
     """Main entry point for the Flask-SocketIO application"""
@@ -22,6 +124,15 @@ def main():
     port = int(os.getenv('PORT', 5000))
     debug = dev_mode or os.getenv('DEBUG', 'False').lower() == 'true'
     use_firebase = os.getenv('USE_FIREBASE', '1') == '1'
+    # Sharded mode: one process per core, each owning a slice of the rooms
+    shard_workers = int(os.getenv('SHARD_WORKERS', '1'))
+    
+    if shard_workers > 1:
+        try:
+            run_shards(shard_workers, host, port)
+        except KeyboardInterrupt:
+            print("\n🛑 Shutting down gracefully...")
+        return
     
     print("=" * 60)
     print("🔮 MATRIX COMMUNICATION BACKEND")
@@ -31,6 +142,7 @@ def main():
     print(f"Port: {port}")
     print(f"Debug: {debug}")
     print(f"Firebase: {'Enabled' if use_firebase else 'Disabled'}")
+    print(f"Server mode: {SERVER_MODE}")
     print(f"Default room: general")
     
     if dev_mode:
@@ -47,16 +159,10 @@ def main():
     print("-" * 60)
     
     try:
-        # Run the Flask-SocketIO server
-        socketio.run(
-            app, 
-            debug=debug, 
-            host=host, 
-            port=port,
-            use_reloader=dev_mode,
-            log_output=dev_mode,
-            allow_unsafe_werkzeug=dev_mode  # Only for development
-        )
+        if SERVER_MODE == 'asgi':
+            run_asgi(host, port, dev_mode)
+        else:
+            run_flask(host, port, debug, dev_mode)
     except KeyboardInterrupt:
         print("\n🛑 Shutting down gracefully...")
         print("Thank you for using Matrix!")
@@ -0,0 +1,258 @@
+"""
+Sharded Room Ownership Across Workers
+
+Optional multi-worker mode. Every worker is a shard; thread rooms and DM
+rooms are assigned to shards by consistent hashing over SHARD_PEERS:
+
+    SHARD_ID=0
+    SHARD_PEERS=0=http://10.0.0.1:5000,1=http://10.0.0.2:5000
+
+The owning shard assigns each message its room sequence number, persists
+it, keeps the room's history cache and broadcasts it through the shared
+Socket.IO message queue (SOCKETIO_MESSAGE_QUEUE). Other shards forward
+sends and history reads to the owner over POST /internal/shard/<op>,
+authenticated by the shared SHARD_SECRET, which sharding requires.
+
+On scale-up every shard is sent the new peer list and hands the rooms it
+no longer owns to their new owners:
+
+    python sharding.py rebalance 0=http://...,1=http://...,2=http://...
+"""
+
+import bisect
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+
+class ShardUnavailable(Exception):
+    """The owning shard could not be reached"""
+
+
+# Payload keys each operation reads, checked before anything is claimed or stored
+SHARD_OP_KEYS = {
+    'send': ('id', 'room', 'username', 'message', 'timestamp', 'user_id'),
+    'history': ('room',),
+    'create_dm': ('dm_room_id', 'info'),
+    'dm_info': ('dm_room_id',),
+    'handoff': ('room',),
+    'rebalance': ('peers',),
+}
+
+
+def invalid_payload(op, payload):
+    """Why a forwarded payload can't be served, or None when it has what op needs"""
+    if not isinstance(payload, dict):
+        return "Payload must be a JSON object"
+    missing = [key for key in SHARD_OP_KEYS.get(op, ()) if key not in payload]
+    if missing:
+        return f"Missing {', '.join(missing)} for {op}"
+    return None
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+def parse_peers(spec):
+    """Parse "0=http://host:5000,1=http://host:5001" into {shard_id: url}"""
+    peers = {}
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        shard_id, sep, url = entry.partition('=')
+        if not sep or not url.strip():
+            raise ValueError(f"Invalid shard peer {entry!r}, expected id=url")
+        peers[shard_id.strip()] = url.strip().rstrip('/')
+    return peers
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes=(), vnodes=64):
+        self.vnodes = vnodes
+        self.nodes = set()
+        self._points = []  # sorted hashes
+        self._owners = []  # node for each point
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            point = _hash(f'{node}#{i}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def owner(self, key):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class RoomSequencer:
+    """Per-room message sequence numbers, assigned by the owning shard"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = {}
+
+    def __contains__(self, room):
+        return room in self._last
+
+    def next(self, room):
+        with self._lock:
+            value = self._last.get(room, 0) + 1
+            self._last[room] = value
+            return value
+
+    def current(self, room):
+        with self._lock:
+            return self._last.get(room, 0)
+
+    def restore(self, room, value):
+        """Seed a room's counter, e.g. from its persisted history or a handoff"""
+        with self._lock:
+            self._last[room] = max(self._last.get(room, 0), value or 0)
+
+    def pop(self, room):
+        with self._lock:
+            return self._last.pop(room, 0)
+
+    def rooms(self):
+        with self._lock:
+            return list(self._last)
+
+
+class ShardRouter:
+    """Maps rooms to their owning shard and forwards operations to it"""
+
+    def __init__(self, shard_id, peers, secret, vnodes=64, timeout=2.0):
+        if shard_id not in peers:
+            raise ValueError(f"SHARD_ID {shard_id!r} is not in SHARD_PEERS")
+        if not secret:
+            # /internal/shard/* would otherwise accept anyone sending an empty X-Shard-Secret
+            raise ValueError("SHARD_SECRET must be set when SHARD_PEERS is")
+        self.shard_id = shard_id
+        self.peers = dict(peers)
+        self.secret = secret
+        self.timeout = timeout
+        self.ring = HashRing(self.peers, vnodes)
+        self._lock = threading.Lock()
+        self._counters = {'forwarded': 0, 'served': 0, 'failed': 0, 'handed_off': 0}
+
+    @classmethod
+    def from_env(cls):
+        """ShardRouter from SHARD_* variables, or None when sharding is off"""
+        spec = os.getenv('SHARD_PEERS', '')
+        if not spec:
+            return None
+        return cls(
+            shard_id=os.getenv('SHARD_ID', '0'),
+            peers=parse_peers(spec),
+            secret=os.getenv('SHARD_SECRET', ''),
+            vnodes=int(os.getenv('SHARD_VNODES', '64')),
+            timeout=float(os.getenv('SHARD_FORWARD_TIMEOUT', '2'))
+        )
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def owner(self, room):
+        return self.ring.owner(room)
+
+    def owns(self, room):
+        return self.owner(room) == self.shard_id
+
+    def authorized(self, secret):
+        return bool(secret) and hmac.compare_digest(secret.encode(), self.secret.encode())
+
+    def served(self):
+        self._count('served')
+
+    def handed_off(self):
+        self._count('handed_off')
+
+    def forward(self, room, op, payload, shard=None):
+        """POST an operation to the room's owner (or the given shard), returning its result"""
+        shard = shard or self.owner(room)
+        request = urllib.request.Request(
+            f"{self.peers[shard]}/internal/shard/{op}",
+            data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json', 'X-Shard-Secret': self.secret},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.loads(response.read())
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            self._count('failed')
+            raise ShardUnavailable(f"Shard {shard} unreachable for {op} on {room}: {e}")
+        self._count('forwarded')
+        return result['result']
+
+    def update_peers(self, peers, rooms):
+        """Swap in a new peer list; returns {room: new_owner} for the given rooms that moved away"""
+        owned = [room for room in rooms if self.owns(room)]
+        with self._lock:
+            self.peers = dict(peers)
+            for node in set(self.ring.nodes) - set(peers):
+                self.ring.remove(node)
+            for node in peers:
+                self.ring.add(node)
+        return {room: self.owner(room) for room in owned if not self.owns(room)}
+
+    def stats(self):
+        with self._lock:
+            return {'shard_id': self.shard_id, 'peers': len(self.peers), **self._counters}
+
+
+def rebalance(peers, secret=''):
+    """Send a new peer list to every shard in it"""
+    for shard_id, url in peers.items():
+        request = urllib.request.Request(
+            f"{url}/internal/shard/rebalance",
+            data=json.dumps({'peers': peers}).encode(),
+            headers={'Content-Type': 'application/json', 'X-Shard-Secret': secret},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                result = json.loads(response.read())['result']
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"Shard {shard_id}: unreachable, rerun once it is up: {e}")
+            continue
+        print(f"Shard {shard_id}: handed off {len(result['handed_off'])} rooms")
+        if result['failed']:
+            print(f"Shard {shard_id}: kept {len(result['failed'])} rooms whose handoff failed, "
+                  f"rerun to retry: {', '.join(result['failed'])}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'rebalance':
+        print("Usage: python sharding.py rebalance id=url,id=url,...")
+        sys.exit(1)
+    if not os.getenv('SHARD_SECRET'):
+        print("SHARD_SECRET must be set to the workers' shared secret")
+        sys.exit(1)
+    rebalance(parse_peers(sys.argv[2]), secret=os.environ['SHARD_SECRET'])
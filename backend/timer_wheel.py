@@ -0,0 +1,160 @@
+"""
+Hierarchical Timer Wheel
+
+One shared scheduler for large numbers of cheap server-side timers (typing
+TTLs, presence timeouts, rate-limit refills, DM inactivity) instead of a
+sleeping greenlet or task per item.
+
+Time advances in ticks of TIMER_TICK seconds. Level 0 has one bucket per
+tick; each higher level covers `slots` buckets of the level below, so four
+levels of 256 slots at 10 ms span about 497 days. A timer sits in the
+lowest level whose current rotation contains its expiry and is moved down
+when that bucket comes up. Scheduling and cancelling are O(1), and a tick
+only touches the timers that are due or being moved down.
+
+Expired timers are delivered in batches: every handler is called once per
+advance with the keys of all its timers that came due.
+
+    wheel.schedule(5.0, expire_typing, sid)   # -> Timer, timer.cancel()
+    wheel.run()                               # from a background loop every tick
+"""
+
+import os
+import threading
+import time
+
+
+class Timer:
+    """A scheduled expiry; cancel() removes it from its bucket"""
+
+    __slots__ = ('expiry', 'handler', 'key', '_bucket', '_wheel')
+
+    def __init__(self, wheel, expiry, handler, key):
+        self._wheel = wheel
+        self.expiry = expiry  # Absolute tick
+        self.handler = handler
+        self.key = key
+        self._bucket = None
+
+    @property
+    def active(self):
+        return self._bucket is not None
+
+    def cancel(self):
+        return self._wheel.cancel(self)
+
+
+class TimerWheel:
+    """Hierarchical timing wheel with O(1) schedule and cancel"""
+
+    def __init__(self, tick=0.01, slots=256, levels=4, clock=time.monotonic):
+        if slots & (slots - 1) or slots < 2:
+            raise ValueError("slots must be a power of two")
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        # Buckets are dicts used as ordered sets, so cancel is a single delete
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._overflow = {}  # Beyond the top level's current rotation
+        self._start = clock()
+        self._now = 0  # Current tick
+        self._count = 0
+        self._lock = threading.RLock()
+        self._counters = {'scheduled': 0, 'fired': 0, 'cascaded': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            tick=float(os.getenv('TIMER_TICK', '0.01')),
+            slots=int(os.getenv('TIMER_WHEEL_SLOTS', '256')),
+            levels=int(os.getenv('TIMER_WHEEL_LEVELS', '4'))
+        )
+
+    def _place(self, timer):
+        expiry, now, bits = timer.expiry, self._now, self._bits
+        for level in range(self.levels):
+            shift = bits * (level + 1)
+            if expiry >> shift == now >> shift:
+                bucket = self._wheels[level][(expiry >> (bits * level)) & self._mask]
+                break
+        else:
+            bucket = self._overflow
+        bucket[timer] = None
+        timer._bucket = bucket
+
+    def schedule(self, delay, handler, key=None):
+        """Call handler([key, ...]) once `delay` seconds have passed"""
+        with self._lock:
+            ticks = max(1, int(-(-delay // self.tick)))  # Round up, never due this tick
+            timer = Timer(self, self._now + ticks, handler, key)
+            self._place(timer)
+            self._count += 1
+            self._counters['scheduled'] += 1
+            return timer
+
+    def cancel(self, timer):
+        with self._lock:
+            bucket = timer._bucket
+            if bucket is None:
+                return False
+            timer._bucket = None
+            del bucket[timer]
+            self._count -= 1
+            return True
+
+    def _cascade(self, bucket):
+        timers = list(bucket)
+        bucket.clear()
+        for timer in timers:
+            self._place(timer)
+        self._counters['cascaded'] += len(timers)
+
+    def expire(self, now=None):
+        """Advance to `now` and return {handler: [keys]} for the timers that came due"""
+        target = int(((self.clock() if now is None else now) - self._start) / self.tick)
+        due = {}
+        with self._lock:
+            if self._count == 0:
+                # Nothing scheduled: jump ahead instead of stepping through empty ticks
+                self._now = max(self._now, target)
+                return due
+            mask, bits = self._mask, self._bits
+            while self._now < target:
+                self._now += 1
+                tick = self._now
+                if tick & mask == 0:
+                    # Level 0 wrapped: move the next bucket of each wrapped level down
+                    for level in range(1, self.levels):
+                        index = (tick >> (bits * level)) & mask
+                        self._cascade(self._wheels[level][index])
+                        if index:
+                            break
+                    else:
+                        self._cascade(self._overflow)
+                bucket = self._wheels[0][tick & mask]
+                if bucket:
+                    for timer in bucket:
+                        timer._bucket = None
+                        due.setdefault(timer.handler, []).append(timer.key)
+                    self._count -= len(bucket)
+                    self._counters['fired'] += len(bucket)
+                    bucket.clear()
+        return due
+
+    def run(self, now=None):
+        """Advance and call each handler with its batch of expired keys"""
+        for handler, keys in self.expire(now).items():
+            try:
+                handler(keys)
+            except Exception as e:
+                print(f"ERROR: Timer handler {getattr(handler, '__name__', handler)} failed: {e}")
+
+    def __len__(self):
+        return self._count
+
+    def stats(self):
+        with self._lock:
+            return {'tick': self.tick, 'active': self._count, **self._counters}
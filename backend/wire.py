@@ -0,0 +1,78 @@
+"""
+Compact Wire Encodings for History and List Payloads
+
+Clients pick a format with the `wire` connect auth field:
+
+    json     - default, one dict per entry with full key names
+    compact  - columnar JSON: {"f": [field codes], "r": [[row values], ...]}
+    msgpack  - the compact table packed with MessagePack (binary attachment)
+
+Only bulk payloads (history, online users, DM lists) are encoded; single
+events such as new_message stay plain JSON.
+"""
+
+try:
+    import msgpack
+except ImportError:  # optional: msgpack clients fall back to compact
+    msgpack = None
+
+WIRE_FORMATS = ('json', 'compact', 'msgpack')
+
+# Short codes for the keys repeated on every entry
+FIELD_CODES = {
+    'id': 'i',
+    'username': 'u',
+    'message': 'm',
+    'room': 'r',
+    'timestamp': 't',
+    'user_id': 's',
+    'firebase_uid': 'f',
+    'server_timestamp': 'T',
+    'firestore_id': 'd',
+    'created_at': 'c',
+    'last_seen': 'l',
+    'dm_room_id': 'R',
+    'other_user': 'o',
+    'last_message_at': 'L',
+    'unread_count': 'n',
+    'online': 'O',
+    'seq': 'q',
+    'client_msg_id': 'k',
+}
+
+
+def negotiate(requested):
+    """Resolve a client's requested format to one this server can produce"""
+    if requested not in WIRE_FORMATS:
+        return 'json'
+    if requested == 'msgpack' and msgpack is None:
+        return 'compact'
+    return requested
+
+
+def _shorten(value):
+    if isinstance(value, dict):
+        return {FIELD_CODES.get(k, k): _shorten(v) for k, v in value.items()}
+    return value
+
+
+def encode_rows(rows, wire):
+    """Encode a list of dicts for the given wire format"""
+    if wire == 'json':
+        return rows
+
+    fields = []
+    seen = set()
+    for row in rows:
+        for key in row:
+            if key not in seen:
+                seen.add(key)
+                fields.append(key)
+
+    table = {
+        'f': [FIELD_CODES.get(field, field) for field in fields],
+        'r': [[_shorten(row.get(field)) for field in fields] for row in rows]
+    }
+    if wire == 'msgpack':
+        return msgpack.packb(table, use_bin_type=True)
+    return table
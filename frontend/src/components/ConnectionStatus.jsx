@@ -37,7 +37,7 @@ const ConnectionStatus = ({ connected, username, roomInfo, onThemeToggle, isDark
 
   const status = getConnectionStatus();
   const roomDisplayName = roomInfo.room === 'general' ? 'General Chat' : roomInfo.room;
-  const onlineCount = roomInfo.users?.length || 0;
+  const onlineCount = roomInfo.member_count ?? (roomInfo.users?.length || 0);
 
   return (
     <div className="chat-header">
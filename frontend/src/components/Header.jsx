@@ -38,7 +38,7 @@ const Header = ({ user, roomInfo, connected, onSignOut, onThemeToggle, isDark })
   };
   
   const roomDisplayName = getRoomDisplayName();
-  const onlineCount = roomInfo.users?.length || 0;
+  const onlineCount = roomInfo.member_count ?? (roomInfo.users?.length || 0);
 
   return (
     <header className="chat-header">
@@ -2,6 +2,27 @@ import { useState, useEffect, useRef } from 'react';
 import { io } from 'socket.io-client';
 
 const SOCKET_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000';
+const WIRE_FORMAT = import.meta.env.VITE_WIRE_FORMAT || 'json';
+
+// Expand a columnar "compact" payload ({f: [codes], r: [[values]]}) back into objects
+const decodeRows = (payload, fieldCodes) => {
+  if (!payload || Array.isArray(payload)) return payload || [];
+  const names = Object.fromEntries(Object.entries(fieldCodes || {}).map(([name, code]) => [code, name]));
+  const expand = (value) => (
+    value && typeof value === 'object' && !Array.isArray(value)
+      ? Object.fromEntries(Object.entries(value).map(([key, v]) => [names[key] || key, expand(v)]))
+      : value
+  );
+  return payload.r.map(row => Object.fromEntries(payload.f.map((code, i) => [names[code] || code, expand(row[i])])));
+};
+
+// Unacknowledged sends are retried with the same client_msg_id, the server stores them once
+const SEND_TIMEOUT_MS = 5000;
+const SEND_RETRIES = 3;
+
+const newClientMsgId = () => (
+  globalThis.crypto?.randomUUID?.() ?? `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+);
 
 const generateDevUserId = () => {
   const randomNum = Math.floor(Math.random() * 1000);
@@ -20,6 +41,8 @@ export const useSocket = (authData) => {
   const [currentRoom, setCurrentRoom] = useState('general');
   
   const socketRef = useRef(null);
+  const fieldCodesRef = useRef(null);
+  const dmHistoryRef = useRef({});
 
   useEffect(() => {
     if (!authData?.user || !authData?.token) return;
@@ -28,13 +51,21 @@ export const useSocket = (authData) => {
       auth: {
         token: authData.token,
         username: authData.user.displayName || authData.user.email,
-        userId: authData.user.uid
+        userId: authData.user.uid,
+        wire: WIRE_FORMAT
       }
     });
 
     socketRef.current = newSocket;
     setSocket(newSocket);
 
+    // Reconnect after the server-provided delay (admission control / drain)
+    let reconnectTimer = null;
+    const scheduleReconnect = (seconds) => {
+      clearTimeout(reconnectTimer);
+      reconnectTimer = setTimeout(() => newSocket.connect(), seconds * 1000);
+    };
+
     newSocket.on('connect', () => {
       console.log('Connected to server');
       setConnected(true);
@@ -46,17 +77,43 @@ export const useSocket = (authData) => {
       setConnected(false);
     });
 
+    newSocket.on('connect_error', (error) => {
+      if (error.data?.retry_after) {
+        console.log(`Server busy, retrying in ${error.data.retry_after}s`);
+        scheduleReconnect(error.data.retry_after);
+      }
+    });
+
+    newSocket.on('server_draining', (data) => {
+      console.log(`Server restarting, reconnecting in ${data.reconnect_after}s`);
+      scheduleReconnect(data.reconnect_after);
+    });
+
     newSocket.on('connected', (data) => {
       console.log('Authentication successful:', data);
+      fieldCodesRef.current = data.field_codes || null;
       setCurrentUserId(data.user_id || newSocket.id);
-      newSocket.emit('join_thread', { room: 'general' });
-      newSocket.emit('get_dm_list');
-      newSocket.emit('get_online_users');
+      // One round trip for room history, DMs, presence and DM previews
+      newSocket.emit('bootstrap', { room: 'general' });
+    });
+
+    newSocket.on('bootstrap', (data) => {
+      console.log('Bootstrap received:', data);
+      const fieldCodes = fieldCodesRef.current;
+      setMessages(decodeRows(data.recent_messages, fieldCodes));
+      setRoomInfo({ room: data.room, users: [] });
+      setCurrentRoom(data.room);
+      setDmList(decodeRows(data.dms, fieldCodes));
+      setOnlineUsers(decodeRows(data.online_users, fieldCodes));
+      dmHistoryRef.current = Object.fromEntries(
+        Object.entries(data.dm_messages || {}).map(([room, rows]) => [room, decodeRows(rows, fieldCodes)])
+      );
+      newSocket.emit('get_room_info');
     });
 
     newSocket.on('joined_thread', (data) => {
       console.log('Joined thread:', data);
-      setMessages(data.recent_messages || []);
+      setMessages(decodeRows(data.recent_messages, fieldCodesRef.current));
       setRoomInfo({ room: data.room, users: [] });
       setCurrentRoom(data.room);
       newSocket.emit('get_room_info');
@@ -64,7 +121,7 @@ export const useSocket = (authData) => {
 
     newSocket.on('room_messages', (data) => {
       console.log('Received room messages:', data);
-      setMessages(data.messages || []);
+      setMessages(decodeRows(data.messages, fieldCodesRef.current));
       setCurrentRoom(data.room);
     });
 
@@ -72,24 +129,47 @@ export const useSocket = (authData) => {
       setMessages(prev => [...prev, message]);
     });
 
-    newSocket.on('user_joined', (data) => {
-      setMessages(prev => [...prev, {
-        id: `system-${Date.now()}`,
-        type: 'system',
-        message: data.message,
-        timestamp: Date.now() / 1000
-      }]);
-      newSocket.emit('get_room_info');
-    });
+    // Joins and leaves arrive aggregated: one frame per room per window
+    const summarize = (users, count, verb) => {
+      if (!count) return null;
+      if (!users) return `${count} ${count === 1 ? 'person' : 'people'} ${verb} the chat`;
+      const others = count - users.length;
+      return `${users.map(u => u.username).join(', ')}${others > 0 ? ` and ${others} others` : ''} ${verb} the chat`;
+    };
 
-    newSocket.on('user_left', (data) => {
-      setMessages(prev => [...prev, {
-        id: `system-${Date.now()}`,
-        type: 'system',
-        message: data.message,
-        timestamp: Date.now() / 1000
-      }]);
-      newSocket.emit('get_room_info');
+    newSocket.on('membership_delta', (delta) => {
+      const isSelf = (u) => u.user_id === newSocket.id;
+      const joined = delta.joined?.filter(u => !isSelf(u));
+      const selfJoined = delta.joined?.some(isSelf) ? 1 : 0;
+      const notices = [
+        summarize(joined, delta.joined_count - selfJoined, 'joined'),
+        summarize(delta.left, delta.left_count, 'left')
+      ].filter(Boolean);
+      if (notices.length) {
+        setMessages(prev => [...prev, ...notices.map((message, i) => ({
+          id: `system-${Date.now()}-${i}`,
+          type: 'system',
+          message,
+          timestamp: Date.now() / 1000
+        }))]);
+      }
+      // Large rooms only send counts; otherwise patch the member list in place
+      setRoomInfo(prev => {
+        if (prev.room !== delta.room) return prev;
+        let users = prev.users || [];
+        if (delta.joined) {
+          const known = new Set(users.map(u => u.user_id));
+          users = [...users, ...delta.joined.filter(u => !known.has(u.user_id))];
+        }
+        if (delta.left) {
+          const gone = new Set(delta.left.map(u => u.user_id));
+          users = users.filter(u => !gone.has(u.user_id));
+        }
+        return { ...prev, users, member_count: delta.member_count };
+      });
+      if (delta.typing_users) {
+        setTypingUsers(delta.typing_users);
+      }
     });
 
     newSocket.on('typing_update', (data) => {
@@ -116,12 +196,12 @@ export const useSocket = (authData) => {
 
     newSocket.on('dm_list', (data) => {
       console.log('DM list received:', data);
-      setDmList(data.dms || []);
+      setDmList(decodeRows(data.dms, fieldCodesRef.current));
     });
 
     newSocket.on('online_users', (data) => {
       console.log('Online users received:', data);
-      setOnlineUsers(data.users || []);
+      setOnlineUsers(decodeRows(data.users, fieldCodesRef.current));
     });
 
     newSocket.on('error', (error) => {
@@ -131,6 +211,7 @@ export const useSocket = (authData) => {
 
     // Cleanup on unmount
     return () => {
+      clearTimeout(reconnectTimer);
       newSocket.close();
     };
   }, [authData]);
@@ -138,7 +219,13 @@ export const useSocket = (authData) => {
   // Socket action functions
   const sendMessage = (messageText) => {
     if (!socket || !connected || !messageText.trim()) return;
-    socket.emit('send_message', { message: messageText });
+    const payload = { message: messageText, client_msg_id: newClientMsgId() };
+    const attempt = (retriesLeft) => {
+      socket.timeout(SEND_TIMEOUT_MS).emit('send_message', payload, (err, ack) => {
+        if ((err || ack?.retry) && retriesLeft > 0) attempt(retriesLeft - 1);
+      });
+    };
+    attempt(SEND_RETRIES);
   };
 
   const sendTyping = (isTyping) => {
@@ -163,6 +250,11 @@ export const useSocket = (authData) => {
 
   const joinDM = (dmRoomId) => {
     if (!socket || !connected) return;
+    // Show prefetched history right away; room_messages replaces it
+    if (dmHistoryRef.current[dmRoomId]) {
+      setMessages(dmHistoryRef.current[dmRoomId]);
+      setCurrentRoom(dmRoomId);
+    }
     socket.emit('join_dm', { dm_room_id: dmRoomId });
   };
 